@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Heuristics that never overestimate, for searches that must be optimal.
+
+Every move shifts each snake's head by at most one cell, whether the snake
+moved itself or got pushed, except that falling is free. So the number of
+moves left is at least how far any one head has to climb and crawl (see
+``Level.climb_map``) to visit the fruit it eats and then the endpoint,
+ignoring every other body on the board. Eating is always a move of its own,
+so every fruit left costs at least one more.
+"""
+from state import FRUIT
+
+# Most fruit the pattern database is built for, it has 2**n entries per
+# fruit and combining snakes costs up to 3**n per node
+pdb_limit = 6
+
+
+def climb_tables(level):
+    """Per level climb maps to every fruit and the endpoint, cached."""
+    tables = level.cache.get('climb')
+    if tables is None:
+        to_fruit = [level.climb_map(idx) for idx in level.fruit]
+        to_end = level.climb_map(level.endpoint) \
+            if level.endpoint >= 0 else None
+        tables = level.cache['climb'] = to_fruit, to_end
+    return tables
+
+
+def _remaining(level, board):
+    """Bit mask of the fruit in ``level.fruit`` that haven't been eaten."""
+    cells = board.cells
+    mask = 0
+    for bit, idx in enumerate(level.fruit):
+        if cells[idx] == FRUIT:
+            mask |= 1 << bit
+    return mask
+
+
+def reach_heuristic(level, board):
+    """Relaxed reachability, each snake on its own.
+
+    Whichever snake eats a fruit has to get there and then on to the
+    endpoint, and every snake has to get to the endpoint. The bound is the
+    worst of those, but never less than the fruit left.
+    """
+    to_fruit, to_end = climb_tables(level)
+    if to_end is None:
+        return 0
+    heads = [segments[0] for segments in board.snakes.values()]
+    cells = board.cells
+    h = max(to_end[head] for head in heads)
+    fruit = 0
+    for idx, distance in zip(level.fruit, to_fruit):
+        if cells[idx] != FRUIT:
+            continue
+        fruit += 1
+        h = max(h, min(max(distance[head], 1) for head in heads) + to_end[idx])
+    return max(h, fruit)
+
+
+def _pattern_database(level):
+    """``tail[mask][i]``, moves from fruit ``i`` through ``mask`` to the end.
+
+    Cheapest order to eat every fruit in ``mask`` starting on fruit ``i``
+    (which is in it) and then reach the endpoint, Held-Karp style over
+    every subset. Only depends on the level so it's built once and cached.
+    """
+    pdb = level.cache.get('pdb')
+    if pdb is not None:
+        return pdb
+    to_fruit, to_end = climb_tables(level)
+    count = len(level.fruit)
+    # Moves from fruit i to fruit j, eating j is at least one move
+    leg = [[max(to_fruit[j][level.fruit[i]], 1) for j in range(count)]
+           for i in range(count)]
+    end = [to_end[idx] if to_end is not None else 0 for idx in level.fruit]
+    tail = [[0] * count for _ in range(1 << count)]
+    for mask in range(1, 1 << count):
+        for i in range(count):
+            if not mask >> i & 1:
+                continue
+            rest = mask & ~(1 << i)
+            if not rest:
+                tail[mask][i] = end[i]
+                continue
+            tail[mask][i] = min(leg[i][j] + tail[rest][j]
+                                for j in range(count) if rest >> j & 1)
+    pdb = level.cache['pdb'] = tail
+    return pdb
+
+
+def _submasks(mask):
+    sub = mask
+    while True:
+        yield sub
+        if not sub:
+            return
+        sub = (sub - 1) & mask
+
+
+def pdb_heuristic(level, board):
+    """Fruit subset pattern database bound, for up to ``pdb_limit`` fruit.
+
+    Each snake gets the cost of eating every subset of the remaining fruit
+    on its own and then leaving, from the pattern database. The fruit have
+    to be shared out between the snakes somehow, and the search takes at
+    least as long as the slowest snake, so the bound is the smallest
+    slowest snake over every way of sharing them out. Falls back on
+    ``reach_heuristic`` for levels with more fruit.
+    """
+    if len(level.fruit) > pdb_limit:
+        return reach_heuristic(level, board)
+    to_fruit, to_end = climb_tables(level)
+    tail = _pattern_database(level)
+    remaining = _remaining(level, board)
+    bits = [i for i in range(len(level.fruit)) if remaining >> i & 1]
+
+    alone = []
+    for segments in board.snakes.values():
+        head = segments[0]
+        cost = {0: to_end[head] if to_end is not None else 0}
+        for sub in _submasks(remaining):
+            if sub:
+                cost[sub] = min(max(to_fruit[i][head], 1) + tail[sub][i]
+                                for i in bits if sub >> i & 1)
+        alone.append(cost)
+
+    # Share fruit between each snake and the ones before it, the last one
+    # only needs sharing out everything that's left
+    best = alone[0]
+    for cost in alone[1:-1]:
+        best = {mask: min(max(best[mask & ~sub], cost[sub])
+                          for sub in _submasks(mask))
+                for mask in _submasks(remaining)}
+    if len(alone) > 1:
+        h = min(max(best[remaining & ~sub], alone[-1][sub])
+                for sub in _submasks(remaining))
+    else:
+        h = best[remaining]
+    return max(h, len(bits))
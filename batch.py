@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Solve every level in a directory in parallel.
+
+Levels are independent, so each one is solved in its own worker process
+and results are written out as JSON, one object per level.
+"""
+import json
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import board as gameboard
+import solver
+from report import Reporter, LimitReached, Stats
+from search import NoSolution
+
+
+def find_levels(directory):
+    """Level files in a directory, numbered levels in numeric order.
+
+    A pack file gives a ``pack.sbp#17`` reference to each of its levels.
+    """
+    if os.path.isfile(directory):
+        import pack
+        return pack.references(directory)
+    names = [name for name in os.listdir(directory)
+             if not name.startswith('.')
+             and os.path.isfile(os.path.join(directory, name))]
+    names.sort(key=lambda name: (not name.isdigit(),
+                                 int(name) if name.isdigit() else 0, name))
+    return [os.path.join(directory, name) for name in names]
+
+
+def solve_level(path, node_limit=None, time_limit=None, **options):
+    """Solve one level file, returns a dict describing the result."""
+    reporter = Reporter(node_limit=node_limit, time_limit=time_limit)
+    stats = Stats()
+    result = {'level': path, 'solution': None, 'length': None}
+    start = time.perf_counter()
+    try:
+        board = gameboard.load_file(path)
+        solution = solver.solve(*board, reporter=reporter, stats=stats,
+                                **options)
+    except NoSolution:
+        result['status'] = 'unsolvable'
+    except LimitReached as e:
+        result['status'] = 'limit'
+        result['error'] = str(e)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = f'{type(e).__name__}: {e}'
+    else:
+        result['status'] = 'solved'
+        result['solution'] = solution
+        result['length'] = len(solution) // 2
+    result['expanded'] = reporter.expanded
+    result['stats'] = stats.as_dict()
+    result['time'] = time.perf_counter() - start
+    # Workers only ever solve one level, so this is the level's peak
+    result['peak_memory_kb'] = \
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def solve_levels(paths, jobs=None, **options):
+    """Solve levels across a process pool, yields results as they finish.
+
+    A level whose worker dies (killed for running out of memory, say) gets
+    an ``'error'`` result with no stats or timings, the others carry on.
+    """
+    with ProcessPoolExecutor(max_workers=jobs,
+                             max_tasks_per_child=1) as pool:
+        futures = {pool.submit(solve_level, path, **options): path
+                   for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {'level': futures[future], 'solution': None,
+                       'length': None, 'status': 'error',
+                       'error': f'{type(e).__name__}: {e}',
+                       'expanded': None, 'stats': None, 'time': None,
+                       'peak_memory_kb': None}
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    from contextlib import nullcontext
+    from search import strategies
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory',
+                        help="directory of level files, or a level pack")
+    parser.add_argument('-j', '--jobs', type=int,
+                        help="worker processes (default: one per core)")
+    parser.add_argument('--node-limit', type=int,
+                        help="give up on a level after this many expansions")
+    parser.add_argument('--time-limit', type=float, metavar='SECONDS',
+                        help="give up on a level after this long")
+    parser.add_argument('--strategy', default='astar',
+                        choices=sorted(strategies))
+    parser.add_argument('--heuristic', choices=sorted(solver.heuristics),
+                        help="default: weighted, or pdb with --optimal")
+    parser.add_argument('--weight', type=float,
+                        help="heuristic weight for wastar and idastar")
+    parser.add_argument('--optimal', action='store_true',
+                        help="only search in ways that find a shortest "
+                             "solution")
+    parser.add_argument('--cache', metavar='FILE',
+                        help="reuse and store solutions in this database")
+    parser.add_argument('-o', '--output', help="write results to this file")
+    args = parser.parse_args()
+
+    paths = find_levels(args.directory)
+    results = []
+    try:
+        for result in solve_levels(paths, jobs=args.jobs,
+                                   node_limit=args.node_limit,
+                                   time_limit=args.time_limit,
+                                   strategy=args.strategy,
+                                   heuristic=args.heuristic,
+                                   weight=args.weight,
+                                   optimal=args.optimal,
+                                   cache=args.cache):
+            results.append(result)
+            took = '' if result['time'] is None else \
+                f" ({result['time']:.2f}s)"
+            print(f"{result['level']}: {result['status']} "
+                  f"{result['length'] or ''}{took}", file=sys.stderr)
+    finally:
+        # Whatever finished is kept, even if the run is cut short
+        results.sort(key=lambda result: paths.index(result['level']))
+        with open(args.output, 'w') if args.output else \
+                nullcontext(sys.stdout) as out:
+            json.dump(results, out, indent=2)
+            out.write('\n')
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmarks for the move engine, gravity, hashing, heuristic and solver.
+
+Results are written as JSON so runs can be compared, ``--compare`` fails
+when any timing got slower than a baseline by more than ``--threshold``.
+"""
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import board as gameboard
+import game
+import level as gamelevel
+import search
+import solver
+import state as gamestate
+from report import Reporter, LimitReached
+
+
+# Generated part of the corpus: name, width, height, snakes, blocks, fruit
+generated = [
+    ('gen-small', 12, 8, 1, 0, 2),
+    ('gen-multi', 20, 12, 3, 2, 3),
+    ('gen-wide', 48, 16, 3, 5, 6),
+    ('gen-large', 100, 60, 3, 5, 10),
+]
+
+
+def generate_level(width, height, snakes=1, blocks=0, fruit=1, seed=0):
+    """Random level text with ledges, straight snakes, blocks and fruit.
+
+    Generated levels are for timing the engine, they aren't necessarily
+    solvable.
+    """
+    rnd = random.Random(seed)
+    rows = [['_'] * width for _ in range(height)]
+    rows[-1] = ['#'] * width
+    for _ in range(max(1, width * height // 40)):
+        y = rnd.randrange(3, height - 1)
+        x = rnd.randrange(width)
+        for dx in range(rnd.randrange(2, 6)):
+            if x + dx < width:
+                rows[y][x + dx] = rnd.choice('####+')
+
+    def place(cells):
+        return all(0 <= y < height - 1 and 0 <= x < width
+                   and rows[y][x] == '_' for y, x in cells)
+
+    def scatter(make, count):
+        for index in range(count):
+            for _ in range(1000):
+                y = rnd.randrange(1, height - 1)
+                x = rnd.randrange(width)
+                cells = make(index, y, x)
+                if place(list(cells)):
+                    for (cy, cx), char in cells.items():
+                        rows[cy][cx] = char
+                    break
+
+    def snake(index, y, x):
+        body, head = 'rgb'[index], 'RGB'[index]
+        length = rnd.randrange(2, 5)
+        cells = {(y, x + i): body for i in range(length - 1)}
+        cells[(y, x + length - 1)] = head
+        return cells
+
+    scatter(snake, min(snakes, 3))
+    scatter(lambda i, y, x: {(y, x): str(i + 1), (y, x + 1): str(i + 1)},
+            min(blocks, 5))
+    scatter(lambda i, y, x: {(y, x): 'F'}, fruit)
+    scatter(lambda i, y, x: {(y, x): 'O'}, 1)
+    return '\n'.join(''.join(row) for row in rows)
+
+
+def load_corpus(directory='levels'):
+    """``(name, level text)`` for the hand built and generated levels."""
+    corpus = []
+    for path in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, path)) as f:
+            corpus.append((f'levels/{path}', f.read()))
+    for seed, (name, *size) in enumerate(generated):
+        corpus.append((name, generate_level(*size, seed=seed)))
+    return corpus
+
+
+def per_call(func, budget=0.2):
+    """Seconds per call of ``func``, best of three timed runs."""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed > budget / 10 or number >= 1 << 20:
+            break
+        number *= 4
+    best = elapsed
+    for _ in range(2):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return best / number
+
+
+def legal_moves(level, board):
+    moves = []
+    for mv in search.next_moves(board):
+        result, log = search.try_move(level, board, mv)
+        if result == game.MOVED:
+            game.undo(board, log)
+            moves.append(mv)
+    return moves
+
+
+def bench_level(text, node_limit, time_limit, budget):
+    grid = gameboard.load_board(text)
+    level = gamelevel.compile_level(*grid)
+    board = gamestate.from_grid(grid[0], level)
+    moves = legal_moves(level, board)
+    illegal = [mv for mv in search.next_moves(board) if mv not in moves]
+    result = {'cells': level.width * level.height,
+              'snakes': len(board.snakes), 'blocks': len(board.blocks),
+              'legal_moves': len(moves)}
+    us = 1e6
+
+    if moves:
+        def apply_and_undo():
+            for mv in moves:
+                game.undo(board, search.apply_move(level, board, mv))
+
+        def move_board_state():
+            for mv in moves:
+                game.move_board_state(*grid, search.colors[mv[0]],
+                                      search.directions[mv[1]])
+
+        result['move_us'] = per_call(apply_and_undo, budget) / len(moves) * us
+        result['move_board_state_us'] = \
+            per_call(move_board_state, budget) / len(moves) * us
+
+    if illegal:
+        def reject():
+            for mv in illegal:
+                search.try_move(level, board, mv)
+
+        result['reject_us'] = per_call(reject, budget) / len(illegal) * us
+
+    # Undone again, like the moves, so every timing sees the same start
+    # state and generated levels (which start unsettled) really fall
+    def gravity():
+        log = game.Undo(level, board)
+        try:
+            game.update_gravity(level, board, log)
+        except game.UnsafeMove:
+            return  # Nothing was changed
+        game.undo(board, log)
+
+    result['gravity_us'] = per_call(gravity, budget) * us
+    result['hash_board_us'] = \
+        per_call(lambda: solver.hash_board(board), budget) * us
+    result['full_hash_us'] = \
+        per_call(lambda: level.zobrist.full_hash(board), budget) * us
+    result['heuristic_us'] = \
+        per_call(lambda: solver.score_heuristic(level, board), budget) * us
+
+    reporter = Reporter(node_limit=node_limit, time_limit=time_limit)
+    start = time.perf_counter()
+    try:
+        solution = solver.solve(*grid, reporter=reporter)
+        result['solution_length'] = len(solution) // 2
+        result['solve_status'] = 'solved'
+    except LimitReached:
+        result['solve_status'] = 'limit'
+    except search.NoSolution:
+        result['solve_status'] = 'unsolvable'
+    elapsed = time.perf_counter() - start
+    result['solve_s'] = elapsed
+    result['solve_expanded'] = reporter.expanded
+    result['solve_nodes_per_s'] = reporter.expanded / elapsed
+    return result
+
+
+def run(corpus, node_limit=5000, time_limit=10, budget=0.2):
+    results = {}
+    for name, text in corpus:
+        print(f"{name}...", file=sys.stderr)
+        results[name] = bench_level(text, node_limit, time_limit, budget)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'node_limit': node_limit,
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold, floor=0.05):
+    """Timings in ``current`` more than ``threshold`` slower than baseline.
+
+    Returns ``(level, metric, old, new)`` for each regression. Only the
+    ``_us`` and ``_s`` timings are compared, and only when both runs have
+    them. Solves that took under ``floor`` seconds are too noisy to compare.
+    """
+    regressions = []
+    for name, metrics in current['results'].items():
+        old = baseline['results'].get(name, {})
+        for metric, value in metrics.items():
+            if not metric.endswith(('_us', '_s')) or metric not in old \
+                    or metric.endswith('_per_s'):
+                continue
+            if metric.endswith('_s') and max(value, old[metric]) < floor:
+                continue
+            if value > old[metric] * (1 + threshold):
+                regressions.append((name, metric, old[metric], value))
+    return regressions
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-o', '--output', default='bench_output.json',
+                        help="where to write results (default: %(default)s)")
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help="results file to check for regressions against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed slowdown as a fraction "
+                             "(default: %(default)s)")
+    parser.add_argument('--node-limit', type=int, default=5000)
+    parser.add_argument('--time-limit', type=float, default=10)
+    parser.add_argument('--quick', action='store_true',
+                        help="shorter timing runs, noisier results")
+    args = parser.parse_args()
+
+    current = run(load_corpus(), node_limit=args.node_limit,
+                  time_limit=args.time_limit,
+                  budget=0.05 if args.quick else 0.2)
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+        f.write('\n')
+
+    for name, metrics in current['results'].items():
+        timings = ', '.join(f"{metric} {value:.1f}"
+                            for metric, value in metrics.items()
+                            if metric.endswith('_us'))
+        print(f"{name}: {timings}, solve {metrics['solve_status']} "
+              f"in {metrics['solve_s']:.2f}s")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for name, metric, old, new in regressions:
+            print(f"REGRESSION {name} {metric}: {old:.2f} -> {new:.2f}")
+        if regressions:
+            sys.exit(1)
@@ -48,97 +48,127 @@ specials_lut = {s[0]: s[1:] for s in specials}
 ignore = ['\n', ' ']
 
 
+# Element names by symbol, and the names of snake heads
+symbols = {brd[1]: brd[0] for brd in boardtable}
+special_symbols = {spc[1]: spc[0] for spc in specials}
+heads = {brd[0] for brd in boardtable if brd[0].endswith(' 0')}
+
+
 def load_file(file_name):
+    """Load a level file, or a level in a pack as ``pack.sbp#17``."""
+    import pack
+    if pack.is_reference(file_name):
+        return pack.load_reference(file_name)
     with open(file_name, 'r') as f:
         return load_board(f.read())
 
 
 def load_board(board_text, padding=1):
+    """Parse a level's text, returns ``(board, teleports, endpoint)``.
+
+    ``board`` is a grid of element names, with snake segments linked head
+    first as ``'snake <color> <n> <next y> <next x>'``. ``padding`` rows
+    and columns of space go all the way around. Teleports and the endpoint
+    are ``(y, x)`` pairs, the endpoint is None if there isn't one.
+    """
     board = []
     teleports = []
     endpoint = None
-    rowlen = 0
-    data = board_text.strip().split('\n')
-    for y, line in enumerate(data):
-        row = []
-        board.append(row)
-        for x, char in enumerate(line):
-            for spc in specials:
-                if spc[1] == char:
-                    row.append('space')
-                    if spc[0] == 'teleport':
-                        teleports.append((y,x))
-                    if spc[0] == 'endpoint':
-                        if endpoint is not None:
-                            raise SnakebirdBoardError("Multiple Endpoints")
-                        endpoint = (y, x)
-                    break
-            else:
-                for brd in boardtable:
-                    if brd[1] == char:
-                        row.append(brd[0])
-                        break
+    for y, line in enumerate(board_text.strip().split('\n'), padding):
+        row = ['space'] * padding
+        for char in line:
+            elem = symbols.get(char)
+            if elem is None:
+                special = special_symbols.get(char)
+                if special is None:
+                    if char in ignore:
+                        continue
+                    raise SnakebirdBoardError(f"Unknown char '{char}'")
+                if special == 'teleport':
+                    teleports.append((y, len(row)))
                 else:
-                    if char not in ignore:
-                        raise SnakebirdBoardError(f"Unknown char '{char}'")
-        rowlen = len(row)
+                    if endpoint is not None:
+                        raise SnakebirdBoardError("Multiple Endpoints")
+                    endpoint = (y, len(row))
+                elem = 'space'
+            row.append(elem)
+        row.extend(['space'] * padding)
+        board.append(row)
+    rowlen = len(board[-1]) if board else 0
+    board[:0] = [['space'] * rowlen for _ in range(padding)]
+    board.extend(['space'] * rowlen for _ in range(padding))
     numrows = len(board)
 
-    # Add padding
-    for row in board:
-        for _ in range(padding):
-            row.insert(0, 'space')
-            row.append('space')
-    rowlen += padding * 2
-    for _ in range(padding):
-        board.insert(0, ['space'] * rowlen)
-        board.append(['space'] * rowlen)
-    numrows += padding * 2
-    if endpoint:
-        endpoint = (endpoint[0] + padding, endpoint[1] + padding)
-    newtel = []
-    for t in teleports:
-        newtel.append((t[0] + padding, t[1] + padding))
-    teleports = newtel
-
-    heads = []
-    for y, line in enumerate(board):
-        for x, elem in enumerate(line):
-            if elem in['snake red 0', 'snake grn 0', 'snake blu 0']:
-                heads.append((y,x))
-
-    for y, x in heads:
-        snake = board[y][x][6:9]
-        index = 0
+    # Follow each snake from its head, always taking the first free
+    # segment of its colour going up, down, left, right
+    starts = [(y, x) for y, row in enumerate(board)
+              for x, elem in enumerate(row) if elem in heads]
+    linked = set(starts)
+    for y, x in starts:
+        body = board[y][x][:9]
+        chain = [(y, x)]
         while True:
-            index = index + 1
-            # Left
-            adjecents = [(y-1, x), (y+1, x), (y, x-1), (y, x+1)]
-            for ay, ax in adjecents:
-                if not (0 <= ax < rowlen) or not (0 <= ay < numrows):
-                    continue
-                adj = board[ay][ax]
-                if adj[0:5] == 'snake' and adj[6:9] == snake:
-                    if len(adj) >= 11:
-                        continue  # already visited!
-                    board[y][x] = board[y][x] + f" {ay} {ax}"
-                    board[ay][ax] = board[ay][ax] + f" {index}"
-                    x, y = ax, ay
+            for ay, ax in ((y-1, x), (y+1, x), (y, x-1), (y, x+1)):
+                if 0 <= ax < rowlen and 0 <= ay < numrows and \
+                        (ay, ax) not in linked and board[ay][ax] == body:
+                    linked.add((ay, ax))
+                    chain.append((ay, ax))
+                    y, x = ay, ax
                     break
             else:
                 # No more segents found!
                 break
+        for index, (y, x) in enumerate(chain):
+            if index + 1 < len(chain):
+                board[y][x] = '%s %d %d %d' % (body, index, *chain[index+1])
+            else:
+                board[y][x] = f'{body} {index}'
 
     return board, teleports, endpoint
 
 
+def iter_pack(file_name, padding=1):
+    """Yield ``(name, level)`` for each level in a pack file, one at a time.
+
+    Levels are separated by blank lines, lines starting with ``;`` are
+    comments and the last one before a level names it, otherwise levels
+    are named by their number counting from 1. ``level`` is what
+    ``load_board`` returns. Only one level's text is held at a time.
+    """
+    with open(file_name, 'r') as f:
+        number = 0
+        name = None
+        lines = []
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line.strip() and not line.startswith(';'):
+                lines.append(line)
+                continue
+            if lines:
+                number += 1
+                yield name or str(number), \
+                    load_board('\n'.join(lines), padding)
+                name = None
+                lines = []
+            if line.startswith(';'):
+                name = line[1:].strip()
+        if lines:
+            number += 1
+            yield name or str(number), load_board('\n'.join(lines), padding)
+
+
+# Board table entries by element name
+elements = {brd[0]: brd for brd in boardtable}
+
 
 def draw_board(board, teleports, endpoint, color=True, fancy=True):
+    """Draw a grid from ``load_board`` as text, see also ``render``."""
     res = []
     if fancy:
         idx = 2
     else:
         idx = 1
+    teleports = set(teleports)
     for y, row in enumerate(board):
         rowchars = []
         for x, elem in enumerate(row):
@@ -146,17 +176,20 @@ def draw_board(board, teleports, endpoint, color=True, fancy=True):
                 if endpoint == (y, x):
                     rowchars.append(specials_lut['endpoint'][idx-1])
                     continue
-                elif (y,x) in teleports:
+                elif (y, x) in teleports:
                     rowchars.append(specials_lut['teleport'][idx-1])
                     continue
-            for brd in boardtable:
-                if elem.startswith(brd[0]):
-                    if color and brd[3]:
-                        rowchars.append(brd[3])
-                    rowchars.append(brd[idx])
-                    if color and brd[3]:
-                        rowchars.append(COLOR_RST)
-                    break
+            brd = elements.get(elem)
+            if brd is None:
+                # Linked snake segment, the head has its own entry
+                spl = elem.split(' ', 3)
+                brd = elements.get(' '.join(spl[:3])) or \
+                    elements[' '.join(spl[:2])]
+            if color and brd[3]:
+                rowchars.append(brd[3])
+            rowchars.append(brd[idx])
+            if color and brd[3]:
+                rowchars.append(COLOR_RST)
         res.append(''.join(rowchars))
     return '\n'.join(res)
 
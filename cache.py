@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Solutions kept on disk between runs, in an SQLite database.
+
+Levels are keyed by a hash of the loaded board, so whitespace and padding
+in the level file don't matter but any change to the level itself does.
+Entries are also tagged with ``game.rules_version`` and only used under the
+same rules. Only whole level results are stored, there's no table of
+dead or solved states to share between levels or searches.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+import game
+
+
+schema = '''
+CREATE TABLE IF NOT EXISTS solutions (
+    level TEXT NOT NULL,
+    rules INTEGER NOT NULL,
+    solution TEXT,
+    optimal INTEGER NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (level, rules)
+)
+'''
+
+
+def level_key(board, teleports, endpoint):
+    """Hex digest identifying a level as returned by ``board.load_board``."""
+    text = json.dumps([board, sorted(map(list, teleports)),
+                       list(endpoint) if endpoint else None],
+                      separators=(',', ':'))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class SolutionCache:
+    """Solutions by level, ``None`` recording a level with no solution.
+
+    Each level keeps one entry, a new solution only replaces the one there
+    if it's shorter or the old one wasn't known to be optimal. Workers in
+    other processes can share a database file.
+    """
+
+    def __init__(self, path, rules=None):
+        self.path = path
+        self.rules = game.rules_version if rules is None else rules
+        self.db = sqlite3.connect(path, timeout=30)
+        with self.db:
+            self.db.execute(schema)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, key, optimal=False):
+        """``(solution, optimal)`` for a level, None on a miss.
+
+        With ``optimal`` set, solutions that weren't known to be shortest
+        count as a miss. Levels proven unsolvable always hit.
+        """
+        row = self.db.execute(
+            'SELECT solution, optimal FROM solutions '
+            'WHERE level = ? AND rules = ?', (key, self.rules)).fetchone()
+        if row is None:
+            return None
+        solution, known_optimal = row
+        if optimal and solution is not None and not known_optimal:
+            return None
+        return solution, bool(known_optimal)
+
+    def put(self, key, solution, optimal=False):
+        """Remember a solution, or None for a level that can't be solved."""
+        old = self.get(key)
+        if old is not None and old[0] is not None and solution is not None:
+            old_solution, old_optimal = old
+            if old_optimal or len(old_solution) <= len(solution) \
+                    and not optimal:
+                return
+        with self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?)',
+                (key, self.rules, solution, int(optimal or solution is None),
+                 time.time()))
+
+    def clear(self):
+        """Drop every entry."""
+        with self.db:
+            self.db.execute('DELETE FROM solutions')
+
+    def prune(self):
+        """Drop entries solved under other rule versions."""
+        with self.db:
+            self.db.execute('DELETE FROM solutions WHERE rules != ?',
+                            (self.rules,))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compiled levels, a binary format that loads without parsing any text.
+
+A record holds a Level with its lookup tables (drop, ground, step and
+portal) and the starting State with its snakes already linked head first,
+so loading one is just copying arrays out of it. Records are length
+prefixed and can follow each other in a stream, ``iter_load`` reads them
+back one at a time. Numbers are little endian.
+
+Each record is::
+
+    header   magic, width, height, endpoint, snake length, teleports,
+             fruit, bodies and the state's hash
+    int32    teleport cells, fruit cells
+    bytes    terrain, ground, cells (one byte per cell each)
+    int32    drop, step up/down/left/right, portal (one per cell each)
+    bodies   code, count, then count int32 cells (snakes head first)
+"""
+import struct
+import sys
+from array import array
+
+import board as gameboard
+from level import Level, compile_level, directions
+from state import State, FRUIT, snake_colors, from_grid
+
+magic = b'SBL1'
+_size = struct.Struct('<I')
+_header = struct.Struct('<4sHHiIHHHQ')
+_body = struct.Struct('<BI')
+
+
+def _ints(values):
+    values = array('i', values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_ints(data, offset, count):
+    values = array('i')
+    values.frombytes(data[offset:offset + 4 * count])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, offset + 4 * count
+
+
+def dumps(level, state):
+    """One record for a level and the state it starts in, as bytes."""
+    bodies = list(state.bodies())
+    parts = [
+        _header.pack(magic, level.width, level.height, level.endpoint,
+                     len(level.zobrist.order), len(level.teleports),
+                     len(level.fruit), len(bodies), state.hash),
+        _ints(level.teleports), _ints(level.fruit),
+        level.terrain, level.ground, bytes(state.cells),
+        _ints(level.drop)]
+    parts.extend(_ints(level.step[direction]) for direction in directions)
+    parts.append(_ints(level.portal))
+    for code, segments in bodies:
+        parts.append(_body.pack(code, len(segments)))
+        parts.append(_ints(segments))
+    data = b''.join(parts)
+    return _size.pack(len(data)) + data
+
+
+def loads(data):
+    """``(level, state)`` from a record made by ``dumps``."""
+    data = memoryview(data)[_size.size:]
+    (mark, width, height, endpoint, length, teleports, fruit, count,
+     hash) = _header.unpack_from(data)
+    if mark != magic:
+        raise ValueError("not a compiled level")
+    area = width * height
+    offset = _header.size
+    teleports, offset = _read_ints(data, offset, teleports)
+    fruit, offset = _read_ints(data, offset, fruit)
+
+    terrain = data[offset:offset + area]
+    ground = data[offset + area:offset + 2 * area]
+    cells = bytearray(data[offset + 2 * area:offset + 3 * area])
+    offset += 3 * area
+    drop, offset = _read_ints(data, offset, area)
+    step = {}
+    for direction in directions:
+        step[direction], offset = _read_ints(data, offset, area)
+    portal, offset = _read_ints(data, offset, area)
+    # Everything Level.__init__ would work out is in the record already
+    level = Level.from_tables(width, height, terrain, endpoint,
+                              list(teleports), length, fruit, drop, ground,
+                              step, portal)
+
+    snakes = {}
+    blocks = {}
+    for _ in range(count):
+        code, size = _body.unpack_from(data, offset)
+        segments, offset = _read_ints(data, offset + _body.size, size)
+        if code in snake_colors:
+            snakes[snake_colors[code]] = segments
+        else:
+            blocks[code] = segments
+    state = State(cells, snakes, blocks, cells.count(FRUIT), hash)
+    return level, state
+
+
+def dump(level, state, stream):
+    """Write one record to a binary stream."""
+    stream.write(dumps(level, state))
+
+
+def load(stream):
+    """Read the next record from a binary stream, None at the end of it."""
+    size = stream.read(_size.size)
+    if not size:
+        return None
+    data = size + stream.read(_size.unpack(size)[0])
+    return loads(data)
+
+
+def iter_load(stream):
+    """Yield ``(level, state)`` for every record left in a stream."""
+    while True:
+        record = load(stream)
+        if record is None:
+            return
+        yield record
+
+
+def compile_board(board, teleports, endpoint):
+    """Record for a level as returned by ``board.load_board``."""
+    level = compile_level(board, teleports, endpoint)
+    return dumps(level, from_grid(board, level))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Compile the levels in a text pack file")
+    parser.add_argument('pack', help="text level or pack of levels")
+    parser.add_argument('output', help="file to write the records to")
+    args = parser.parse_args()
+    with open(args.output, 'wb') as out:
+        for name, level in gameboard.iter_pack(args.pack):
+            out.write(compile_board(*level))
+            print(name)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Finishing a level off once the fruit's all gone.
+
+With no fruit left all that's left is getting every snake out through the
+endpoint, which is usually a long walk the main search would go through
+one move at a time, for every snake in every order. Instead each snake in
+turn takes the shortest walk out it can find on its own, with the others
+standing still as obstacles, trying every order the snakes could go in.
+Walks that would push or knock anything else about aren't taken, so this
+can miss ways out, but whatever it finds is a real solution of known
+length that the main search can pick up as a goal.
+"""
+import heapq
+from itertools import count, permutations
+
+import game
+from admissible import climb_tables
+from macro import touches
+from search import try_move
+
+# Most positions each snake's walk out looks at
+walk_limit = 1000
+
+# Most boards remembered on the level, for the endgames found and for each
+# snake's stuck positions. A full cache is emptied and starts over.
+cache_limit = 100000
+
+
+def walk_out(level, board, snake, limit=None):
+    """Shortest moves for ``snake`` alone to leave through the endpoint.
+
+    Returns ``(moves, board)`` with a copy of the board once it's gone,
+    which is None if that finished the level, or None if there's no way out
+    within ``limit`` positions. ``board`` is left as it was.
+
+    It's an A* over the snake's own moves, guided by how far its head has
+    to climb to the endpoint (see ``Level.climb_map``), so it heads for the
+    way out rather than walking everywhere first. When every position the
+    snake can walk to has been tried they're remembered on the level, the
+    snake can't get out from any of them while the rest stay put.
+    """
+    if limit is None:
+        limit = walk_limit
+    stuck = level.cache.setdefault('stuck', {}).setdefault(snake, set())
+    if board.hash in stuck:
+        return None
+    _, to_end = climb_tables(level)
+    code = game.snake_codes[snake]
+    seen = {board.hash}
+    order = count()
+    walk = [(to_end[board.snakes[snake][0]], next(order), board, '')]
+    while walk and len(seen) <= limit:
+        _, _, here, path = heapq.heappop(walk)
+        for direction in 'wasd':
+            mv = path + snake[0] + direction
+            result, log = try_move(level, here, mv[-2:])
+            if result == game.COMPLETE:
+                return mv, None
+            if result != game.MOVED:
+                continue
+            if snake not in here.snakes:
+                out = here.copy()
+                game.undo(here, log)
+                return mv, out
+            if not touches(here, snake, code, log) and \
+                    here.hash not in seen:
+                seen.add(here.hash)
+                h = to_end[here.snakes[snake][0]]
+                heapq.heappush(walk, (len(mv) // 2 + h, next(order),
+                                      here.copy(), mv))
+            game.undo(here, log)
+    if not walk:
+        if len(stuck) + len(seen) > cache_limit:
+            stuck.clear()
+        if len(seen) <= cache_limit:
+            stuck.update(seen)
+    return None
+
+
+def endgame(level, board, stats=None, limit=None):
+    """Moves that finish the level from a board with no fruit left.
+
+    The shortest way out over every order of the snakes, each using
+    ``walk_out``. None if the board still has fruit or no order works.
+    Results are cached on the level by board hash, up to ``cache_limit``
+    of them.
+    """
+    if board.fruit or level.endpoint < 0:
+        return None
+    found = level.cache.setdefault('endgame', {})
+    if board.hash in found:
+        return found[board.hash]
+    best = None
+    for order in permutations(board.snakes):
+        here = board
+        moves = ''
+        for snake in order:
+            out = walk_out(level, here, snake, limit)
+            if out is None:
+                break
+            mv, here = out
+            moves += mv
+            if here is None or best is not None and len(moves) >= len(best):
+                break
+        if here is None and (best is None or len(moves) < len(best)):
+            best = moves
+    if best is not None and stats is not None:
+        stats.endgames += 1
+    if len(found) >= cache_limit:
+        found.clear()
+    found[board.hash] = best
+    return best
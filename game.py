@@ -1,6 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import copy
+import heapq
+from array import array
+
+from level import compile_level
+from state import SPACE, SPIKE, FRUIT, snake_codes, snake_colors
+from state import from_grid, to_grid
+
+try:
+    import vector
+except ImportError:
+    vector = None
 
 
 class SnakebirdMoveError(Exception):
@@ -23,353 +33,503 @@ class MissionComplete(Exception):
     """We are done!"""
 
 
-class NothingLeft(Exception):
-    """Indicates nothign left to do in a step."""
-
-
-def update_gravity(board, teleports, endpoint):
+# Gravity is worked out with NumPy, when it's installed (see vector.py),
+# on boards with at least vector_area cells where the free cells below all
+# the bodies add up to at least vector_work. Below that the fixed cost of
+# calling into NumPy is more than walking down the columns in Python.
+vector_area = 2500
+vector_work = 5000
+
+# Bump whenever a rule change could change which moves are legal or what
+# they do, anything solved under another version is solved again
+rules_version = 2
+
+# Results of try_move, the exception each one stands for is in move_errors
+MOVED, COMPLETE, ILLEGAL, UNSAFE, INVALID = range(5)
+move_errors = {
+    COMPLETE: MissionComplete,
+    ILLEGAL: IllegalMove,
+    UNSAFE: UnsafeMove,
+    INVALID: InvalidMove}
+
+
+class Undo:
+    """Log of the changes made to a State, so they can be rolled back.
+
+    ``cells`` holds flat ``idx, old_code`` pairs and ``bodies`` holds
+    ``(code, old_segments)`` pairs, ``old_segments`` is None for a body that
+    did not exist before.
+    """
+    __slots__ = ('cells', 'bodies', 'fruit', 'hash', 'zobrist')
+
+    def __init__(self, level, state):
+        self.cells = array('i')
+        self.bodies = []
+        self.fruit = state.fruit
+        self.hash = state.hash
+        self.zobrist = level.zobrist
+
+
+def _set_cell(state, idx, code, log):
+    old = state.cells[idx]
+    log.cells.append(idx)
+    log.cells.append(old)
+    kinds = log.zobrist.kinds
+    state.hash ^= kinds[old][idx] ^ kinds[code][idx]
+    state.cells[idx] = code
+
+
+def _set_body(state, code, segments, log):
+    """Replace a body's segment array, None removes the body."""
+    if code in snake_colors:
+        table, key = state.snakes, snake_colors[code]
+        old = table.get(key)
+        if old is not None:
+            state.hash ^= log.zobrist.segments_hash(old)
+        if segments is not None:
+            state.hash ^= log.zobrist.segments_hash(segments)
+    else:
+        table, key = state.blocks, code
+    log.bodies.append((code, table.get(key)))
+    if segments is None:
+        del table[key]
+    else:
+        table[key] = segments
 
-    # Optimization. Find rows with no object in them
-    interesting_rows = set()
-    interesting_cols = set()
-    for y, row in enumerate(board):
-        for x, elem in enumerate(row):
-            elem_class = elem[0:5]
-            if elem_class in ['snake', 'block']:
-                interesting_rows.add(y)
-                interesting_cols.add(y)
 
-    falling = {}
-    spiked = {}  # Distance snakes will hit spikes at
-    deleted = []
-    very_far = 1000
-    super_far = 10000
-    fallable = ['snake', 'block']
-    height = len(board)
-    for y, row in reversed(list(enumerate(board))):
-        if y not in interesting_rows:
+def undo(state, log):
+    """Roll back every change recorded in ``log``, in place."""
+    for code, segments in reversed(log.bodies):
+        if code in snake_colors:
+            table, key = state.snakes, snake_colors[code]
+        else:
+            table, key = state.blocks, code
+        if segments is None:
+            table.pop(key, None)
+        else:
+            table[key] = segments
+    cells = state.cells
+    changes = log.cells
+    for i in range(len(changes) - 2, -1, -2):
+        cells[changes[i]] = changes[i+1]
+    state.fruit = log.fruit
+    state.hash = log.hash
+
+
+def _offset(level, direction):
+    return {'left': -1, 'right': 1,
+            'up': -level.width, 'down': level.width}[direction]
+
+
+def _shift(state, moves, log):
+    """Move bodies by a per-body index offset, ``moves`` maps code->offset."""
+    for code in moves:
+        for idx in state.body(code):
+            _set_cell(state, idx, SPACE, log)
+    for code, offset in moves.items():
+        new = array('i', [idx + offset for idx in state.body(code)])
+        for idx in new:
+            _set_cell(state, idx, code, log)
+        _set_body(state, code, new, log)
+
+
+def update_gravity(level, state, log):
+    """Drop every snake and block to where it comes to rest, in place.
+
+    Returns ``(state, dirty)``, raises UnsafeMove without touching the
+    state if a snake would fall onto spikes or off the board.
+    """
+    falling = _falls(level, state)
+    if falling is None:
+        raise UnsafeMove()
+    return state, _drop(level, state, falling, log)
+
+
+def _falls(level, state):
+    """How far each body falls, None if that kills a snake.
+
+    Each body falls as one rigid object. A body can fall as far as the
+    terrain, fruit or endpoint below it allows (its own bound), or as far as
+    the gap to a body below it plus however far that body falls. That's a
+    shortest path problem over the support graph, so it's solved in one
+    pass in order of increasing fall with a heap.
+
+    The bounds come from ``_bounds``, or ``vector.bounds`` on big boards.
+    """
+    never = len(state.cells)
+    drop = level.drop
+    if vector is not None and never >= vector_area and \
+            sum(drop[idx] for _, segments in state.bodies()
+                for idx in segments) >= vector_work:
+        bound, lost, resting = vector.bounds(level, state)
+    else:
+        bound, lost, resting = _bounds(level, state)
+
+    falling = dict(bound)
+    heap = [(fall, code) for code, fall in falling.items() if fall < never]
+    heapq.heapify(heap)
+    while heap:
+        fall, code = heapq.heappop(heap)
+        if fall > falling[code]:
             continue
-        for x, elem in enumerate(row):
-            elem_class = elem[0:5]
-            if elem_class not in fallable:
-                continue
-            elem_id = ' '.join(elem.split()[0:2])
-
-            if elem_id not in falling.keys():
-                falling[elem_id] = super_far
-
-            for t_y in range(y+1, height):
-                target = board[t_y][x]
-                target_class = target.split()[0]
-                target_id = ' '.join(target.split()[0:2])
-
-                if target_id == elem_id:
-                    break
-
-                if target_class == 'space':
-                    # Special cases
-                    if elem_class == 'snake':
+        if fall >= lost[code]:
+            # Gone before it gets there, so it holds nothing up
+            falling[code] = never
+            continue
+        for gap, above in resting.get(code, ()):
+            if gap + fall < falling[above]:
+                falling[above] = gap + fall
+                heapq.heappush(heap, (gap + fall, above))
+
+    for code, fall in falling.items():
+        if fall >= never and code in snake_colors:
+            return None
+    return falling
+
+
+def _bounds(level, state):
+    """Per body fall bounds for ``_falls``, ``(bound, lost, resting)``.
+
+    ``bound`` is how far each body can fall on its own and ``lost`` how far
+    it can fall before it's gone, off the bottom of the board or (snakes
+    only) onto spikes, both ``len(cells)`` for never. ``resting`` maps a
+    body's code to ``(gap, code)`` for every body resting on it.
+    """
+    cells = state.cells
+    width = level.width
+    drop = level.drop
+    ground = level.ground
+    end = level.endpoint if not state.fruit else -1
+    never = len(cells)
+
+    bound = {}    # How far each body can fall on its own
+    lost = {}     # How far each body can fall before it's gone
+    resting = {}  # code -> [(gap, code of the body resting on it)]
+    for code, segments in state.bodies():
+        is_snake = code in snake_colors
+        fall = never
+        gone = never
+        head = segments[0]
+        for idx in segments:
+            # Only the free cells above the terrain need looking at
+            free = drop[idx]
+            t = idx
+            for dist in range(1, free + 1):
+                t += width
+                target = cells[t]
+                if target == SPACE:
+                    if t == end and idx == head and is_snake:
                         # Fall into endpoint
-                        is_head = elem.split()[2] == '0'
-                        if is_head and endpoint == (t_y, x):
-                            new_fall = t_y - y
-                            falling[elem_id] = min(falling[elem_id], new_fall)
-                        # TODO: teleport
-
+                        fall = min(fall, dist)
                     continue
-                elif target_class in fallable:
-                    new_fall = t_y - (y+1) + falling[target_id]
-                    falling[elem_id] = min(falling[elem_id], new_fall)
-                    break
-                else:
-                    # Solid ground!
-                    if elem_class == 'snake' and target_class == 'spike':
-                        spiked[elem_id] = t_y - y
-                        # Spikes won't help snakes!
-                        break
-                    new_fall = t_y - (y+1)
-                    falling[elem_id] = min(falling[elem_id], new_fall)
-                    break
-
-    for elem in falling.keys():
-        elem_class = elem.split()[0]
-        elem_id = ' '.join(elem.split()[0:2])
-        if elem_id in spiked and spiked[elem_id] <= falling[elem_id]:
-            raise UnsafeMove()
-        if falling[elem_id] > very_far:
-            if elem_class == 'snake':
-                raise UnsafeMove()
+                if target == FRUIT:
+                    fall = min(fall, dist - 1)
+                elif target != code:
+                    resting.setdefault(target, []).append((dist - 1, code))
+                break
             else:
-                deleted.append(elem_id)
+                under = ground[idx]
+                if under == SPACE or is_snake and under == SPIKE:
+                    # Off the board, and spikes won't help snakes!
+                    gone = min(gone, free + 1)
+                    continue
+                fall = min(fall, free)
+        bound[code] = fall
+        lost[code] = gone
+    return bound, lost, resting
 
+
+def _drop(level, state, falling, log):
+    """Move bodies down by the distances from ``_falls``, True if any did."""
+    width = level.width
+    never = len(state.cells)
     dirty = False
-    # TODO: This line is needed to keep functional purity
-    # but it is extremely nonperformant
-    # board = copy.deepcopy(board)
-    for y, row in reversed(list(enumerate(board))):
-        if y not in interesting_rows:
+    moves = {}
+    for code, distance in falling.items():
+        if distance == 0:
             continue
-        for x, elem in enumerate(row):
-            elem_class = elem[0:5]
-            if elem_class not in fallable:
-                continue
-            elem_id = ' '.join(elem.split()[0:2])
-
-            distance = falling[elem_id]
-            if distance == 0:
-                continue
-
-            dirty = True
-
-            if elem_id in deleted:
-                board[y][x] = 'space'
-                continue
-
-            # snake fixup
-            spl = elem.split()
-            if len(spl) == 5:
-                # We gotta relink a snake as we move it
-                o_y, o_x = [int(s) for s in spl[3:5]]
-                n_x, n_y = str(o_x), str(o_y + distance)
-                elem = ' '.join(spl[0:3] + [n_y, n_x])
-
-            board[y+distance][x] = elem
-            board[y][x] = 'space'
-
-    return board, dirty
-
-
-def attempt_push(board, pushed, direction):
-    orig_board = board
-    board = copy.deepcopy(board)
-
-    if direction == 'down':
-        board_orient = reversed(list(enumerate(board)))
-    else:
-        board_orient = enumerate(board)
-
-    for y, row in board_orient:
-        if direction == 'right':
-            row_orient = reversed(list(enumerate(row)))
-        else:
-            row_orient = enumerate(row)
-
-        for x, elem in row_orient:
-            elem_id = ' '.join(elem.split()[0:2])
-            if elem_id not in pushed:
+        dirty = True
+        if distance >= never:
+            # Fell off the board
+            for idx in state.blocks[code]:
+                _set_cell(state, idx, SPACE, log)
+            _set_body(state, code, None, log)
+            continue
+        moves[code] = distance * width
+    _shift(state, moves, log)
+    return dirty
+
+
+def _push_set(level, state, pushed, direction):
+    """Every body that moves when pushing ``pushed``, None if it's blocked.
+
+    Only reads the state.
+    """
+    cells = state.cells
+    terrain = level.terrain
+    step = level.step[direction]
+    pushed = list(pushed)
+    for code in pushed:
+        for idx in state.body(code):
+            t = step[idx]
+            if t < 0:
+                # Cant push off the board
+                return None
+            target = cells[t]
+            if target == code:
                 continue
-
-            if direction == 'left':
-                t_x, t_y = x-1, y
-            if direction == 'right':
-                t_x, t_y = x+1, y
-            if direction == 'up':
-                t_x, t_y = x, y-1
-            if direction == 'down':
-                t_x, t_y = x, y+1
-
-            target = board[t_y][t_x]
-            target_cls = target.split()[0]
-
-            if target_cls == 'space':
-                # DO the movement
-                spl = elem.split()
-                if len(spl) == 5:
-                    # We gotta relink a snake as we move it
-                    o_y, o_x = [int(s) for s in spl[3:5]]
-                    if direction == 'left':
-                        n_x, n_y = o_x-1, o_y
-                    if direction == 'right':
-                        n_x, n_y = o_x+1, o_y
-                    if direction == 'up':
-                        n_x, n_y = o_x, o_y-1
-                    if direction == 'down':
-                        n_x, n_y = o_x, o_y+1
-                    n_x, n_y = str(n_x), str(n_y)
-                    elem = ' '.join(spl[0:3] + [n_y, n_x])
-
-                board[t_y][t_x] = elem
-                board[y][x] = 'space'
-            elif target_cls in ['solid', 'spike', 'fruit']:
+            if terrain[t] != SPACE or target == FRUIT:
                 # Cant push into a solid!
-                raise IllegalMove("Cant push into solids")
-            elif target_cls in ['snake', 'block']:
-                # Recurse with more items
-                target_id = ' '.join(target.split()[0:2])
-                pushed.append(target_id)
-                return attempt_push(orig_board, pushed, direction)
-            else:
-                raise InvalidMove(f"Cant push into {target}")
-
-    return board
+                return None
+            if target != SPACE and target not in pushed:
+                # Push with more items
+                pushed.append(target)
+    return pushed
+
+
+def update_end(level, state, log):
+    """Remove a snake whose head reached the endpoint, in place."""
+    end = level.endpoint
+    if end < 0 or state.fruit:
+        return state, False
+    code = state.cells[end]
+    color = snake_colors.get(code)
+    if color is None or state.snakes[color][0] != end:
+        return state, False
+    for idx in state.snakes[color]:
+        _set_cell(state, idx, SPACE, log)
+    _set_body(state, code, None, log)
+    return state, True
+
+
+def update_teleports(level, state, heads, teleported, log):
+    """Send snakes whose head just got onto a teleport through it, in place.
+
+    ``heads`` are where the heads were before the move, a snake whose head
+    hasn't moved doesn't go anywhere, and ``teleported`` collects the ones
+    that have been dealt with so nothing goes back and forth. The whole
+    snake moves by the offset between the two teleports, as long as every
+    cell it lands on is free. Returns True if any snake went through.
+    """
+    portal = level.portal
+    width = level.width
+    height = level.height
+    terrain = level.terrain
+    cells = state.cells
+    moved = False
+    for color, segments in list(state.snakes.items()):
+        head = segments[0]
+        exit = portal[head]
+        if exit < 0 or color in teleported or heads.get(color) == head:
+            continue
+        teleported.add(color)
+        code = snake_codes[color]
+        dy, dx = exit // width - head // width, exit % width - head % width
+        for idx in segments:
+            y, x = idx // width + dy, idx % width + dx
+            t = y * width + x
+            if not (0 <= y < height and 0 <= x < width) or \
+                    terrain[t] != SPACE or cells[t] not in (SPACE, code):
+                break  # Exit is blocked
+        else:
+            _shift(state, {code: exit - head}, log)
+            moved = True
+    return moved
 
 
-def update_end(board, endpoint):
-    dirty = False
+def any_fruit_exists(state):
+    return state.fruit > 0
 
-    board = copy.deepcopy(board)
-    if not endpoint:
-        return board, False
-    elem = board[endpoint[0]][endpoint[1]]
-    elem_cls = elem.split()[0]
-    removed = []
-    if elem_cls == 'snake':
-        is_head = elem.split()[2] == '0'
-        if is_head and not any_fruit_exists(board):
-            elem_id = ' '.join(elem.split()[0:2])
-            removed.append(elem_id)
-
-    for rem in removed:
-        dirty = True
-        for y, row in enumerate(board):
-            for x, elem in enumerate(row):
-                if elem.startswith(rem):
-                    board[y][x] = 'space'
 
-    return board, dirty
+def any_snakes_exist(state):
+    return bool(state.snakes)
 
 
-def any_fruit_exists(board):
-    for row in board:
-        for elem in row:
-            if elem == 'fruit':
-                return True
-    return False
+def check_move(level, state, snake, direction):
+    """Cheap check whether a move could be legal, without changing anything.
 
+    Returns INVALID or ILLEGAL for moves that can be ruled out up front
+    (unknown snakes, moving off the board or into terrain, pushes that are
+    blocked or would push the snake itself), MOVED otherwise. Moves that
+    pass can still turn out unsafe or finish the level once gravity runs.
+    """
+    if direction not in level.step:
+        return INVALID
+    segments = state.snakes.get(snake)
+    if segments is None:
+        return INVALID
+    target = level.step[direction][segments[0]]
+    if target < 0:
+        return INVALID
+    if level.terrain[target] != SPACE:
+        # No can do
+        return ILLEGAL
+    blocker = state.cells[target]
+    if blocker == SPACE or blocker == FRUIT:
+        return MOVED
+    code = snake_codes[snake]
+    if blocker == code:
+        # We can't push ourselves!
+        return ILLEGAL
+    pushed = _push_set(level, state, [blocker], direction)
+    if pushed is None or code in pushed:
+        # Blocked, or the push goes round and pushes us too
+        return ILLEGAL
+    return MOVED
+
+
+def try_move(level, state, snake, direction, keep=False):
+    """Apply a move to a State in place, returns ``(result, log)``.
+
+    ``result`` is one of MOVED, COMPLETE, ILLEGAL, UNSAFE or INVALID. Only
+    a MOVED state is left changed, with ``log`` to undo it, anything else
+    leaves the state as it was and ``log`` None. With ``keep`` set a
+    COMPLETE state is left finished as well, with its log. Moves ruled out
+    by check_move never copy or write anything.
+    """
+    result = check_move(level, state, snake, direction)
+    if result != MOVED:
+        return result, None
+
+    log = Undo(level, state)
+    result = _try_move(level, state, snake, direction, log)
+    if result != MOVED and not (keep and result == COMPLETE):
+        undo(state, log)
+        return result, None
+    if level.check_hash and state.hash != level.zobrist.full_hash(state):
+        raise AssertionError("Zobrist hash drifted")
+    return result, log
+
+
+def expand_batch(level, states, moves, skip=None):
+    """Try every one of ``moves`` on every one of ``states`` at once.
+
+    ``moves`` is a list of ``(snake, direction)`` pairs, moves for snakes a
+    state doesn't have are INVALID. Returns ``(results, hashes, boards)``
+    indexed by ``i * len(moves) + j`` for move ``j`` on state ``i``:
+    ``results`` is a bytearray of try_move results, ``hashes`` an
+    ``array('Q')`` of the new hashes (0 unless MOVED) and ``boards`` a list
+    of copies of the new states, None unless MOVED.
+
+    ``skip(i, hash)`` can say a MOVED state isn't wanted, it's then left
+    out of ``boards`` without being copied. The states are left as they
+    were.
+    """
+    count = len(states) * len(moves)
+    results = bytearray(count)
+    hashes = array('Q', bytes(8 * count))
+    boards = [None] * count
+    k = 0
+    for i, state in enumerate(states):
+        for snake, direction in moves:
+            result, log = try_move(level, state, snake, direction)
+            results[k] = result
+            if result == MOVED:
+                hashes[k] = state.hash
+                if skip is None or not skip(i, state.hash):
+                    boards[k] = state.copy()
+                undo(state, log)
+            k += 1
+    return results, hashes, boards
+
+
+def _try_move(level, state, snake, direction, log):
+    cells = state.cells
+    code = snake_codes[snake]
+    segments = state.snakes[snake]
+    target = level.step[direction][segments[0]]
+    blocker = cells[target]
+    if level.teleports:
+        heads = {color: body[0] for color, body in state.snakes.items()}
+
+    if blocker == FRUIT:
+        # We advance the snake's head and grow
+        _set_cell(state, target, code, log)
+        _set_body(state, code, array('i', [target]) + segments, log)
+        state.fruit -= 1
+    else:
+        if blocker != SPACE:
+            # check_move already made sure the push goes through
+            offset = _offset(level, direction)
+            pushed = _push_set(level, state, [blocker], direction)
+            _shift(state, {body: offset for body in pushed}, log)
+        # We advance the snake's head
+        _set_cell(state, segments[-1], SPACE, log)
+        _set_cell(state, target, code, log)
+        _set_body(state, code, array('i', [target]) + segments[:-1], log)
+
+    update_end(level, state, log)
+    if level.teleports:
+        teleported = set()
+        update_teleports(level, state, heads, teleported, log)
+
+    # Gravity settles everything in one go, it only has to run again if a
+    # snake dropped into the endpoint and stopped holding something up, or
+    # fell onto a teleport and went through.
+    while True:
+        falling = _falls(level, state)
+        if falling is None:
+            return UNSAFE
+        _drop(level, state, falling, log)
+        state, removed = update_end(level, state, log)
+        if level.teleports and \
+                update_teleports(level, state, heads, teleported, log):
+            continue
+        if not removed:
+            break
 
-def any_snakes_exist(board):
-    for row in board:
-        for elem in row:
-            if elem.startswith('snake'):
-                return True
-    return False
+    if not any_snakes_exist(state):
+        return COMPLETE
+    return MOVED
 
 
-def move_board_state(board, teleports, endpoint, snake, direction):
-    board = copy.deepcopy(board)
-    b_x, b_y = len(board[0]), len(board)
+def apply_move(level, state, snake, direction):
+    """Apply a move to a State in place and return its Undo log.
 
+    Wraps try_move, raising the matching exception for any move that
+    doesn't just move. The state is left as it was when it raises.
+    """
     if snake not in ['red', 'grn', 'blu']:
         raise InvalidMove(f"Unknown snake '{snake}'")
     if direction not in ['up', 'down', 'left', 'right']:
         raise InvalidMove(f"Unknown direction '{direction}'")
-
-    def find_snake():
-        for y, row in enumerate(board):
-            for x, elem in enumerate(row):
-                splitelem = elem.split()
-                if len(splitelem) >= 3 and splitelem[2] == '0':
-                    if splitelem[1] == snake:
-                        return x, y
+    if snake not in state.snakes:
         raise InvalidMove(f"Cannot find snake '{snake}'")
+    result, log = try_move(level, state, snake, direction)
+    if result != MOVED:
+        raise move_errors[result]()
+    return log
 
-    x, y = find_snake()
-
-    if direction == 'left' and x == 0:
-        raise InvalidMove(f"Moving off of board {direction}")
-    if direction == 'right' and x == b_x-1:
-        raise InvalidMove(f"Moving off of board {direction}")
-    if direction == 'up' and y == 0:
-        raise InvalidMove(f"Moving off of board {direction}")
-    if direction == 'down' and y == b_y-1:
-        raise InvalidMove(f"Moving off of board {direction}")
-
-    if direction == 'left':
-        t_x, t_y = x-1, y
-    if direction == 'right':
-        t_x, t_y = x+1, y
-    if direction == 'up':
-        t_x, t_y = x, y-1
-    if direction == 'down':
-        t_x, t_y = x, y+1
-
-    blocker = board[t_y][t_x]
-    blocker_class = blocker.split()[0]
-
-    if blocker == 'fruit':
-        # We advance the snake's head
-        segment = 0
-        board[t_y][t_x] = f'snake {snake} {segment} {y} {x}'
-        # Build out our snake body
-        while True:
-            segment += 1
-            snake_parts = board[y][x].split()
-            if len(snake_parts) == 5:
-                next_y = int(snake_parts[3])
-                next_x = int(snake_parts[4])
-                board[y][x] = f'snake {snake} {segment} {next_y} {next_x}'
-                x = next_x
-                y = next_y
-            else:
-                board[y][x] = f'snake {snake} {segment}'
-                break
 
-    if blocker_class == 'snake' or blocker_class == 'block':
-        # We need to calculate pushing
-        # Try to push, will raise an exception if we cannot
-        # If we can we set the blocker to space and continue
-        blocker_id = ' '.join(blocker.split()[0:2])
-        board = attempt_push(board, [blocker_id], direction)
-        if board[t_y][t_x] != 'space':
-            # Theo nly way our push suceeded yet tere is no space is
-            # if we moved (were pushed) ourselves! This is illegal!
-            raise IllegalMove()
-        blocker = 'space'
-
-    if blocker == 'space':
-        # We advance the snake's head
-        segment = 0
-        board[t_y][t_x] = f'snake {snake} {segment} {y} {x}'
-        # Build out our snake body
-        while True:
-            segment += 1
-            snake_parts = board[y][x].split()
-            if len(snake_parts) == 5:
-                next_y = int(snake_parts[3])
-                next_x = int(snake_parts[4])
-                next_seg = board[next_y][next_x]
-                if int(snake_parts[2]) > 100:
-                    raise Exception("Snake Overflow")
-                if len(next_seg.split()) < 5:
-                    board[y][x] = f'snake {snake} {segment}'
-                else:
-                    board[y][x] = f'snake {snake} {segment} {next_y} {next_x}'
-                x = next_x
-                y = next_y
-            else:
-                board[y][x] = f'space'
-                break
-
-    if blocker == 'solid' or blocker == 'spikes':
-        # No can do
-        raise IllegalMove()
+def move_state(level, state, snake, direction):
+    """Apply a move to a packed State, returning a new State."""
+    state = state.copy()
+    apply_move(level, state, snake, direction)
+    return state
 
-    try:
-        board , _= update_end(board, endpoint)
-    except NothingLeft:
-        pass
 
-    dirty = True
-    while dirty:
-        dirty = False
-        board, d = update_gravity(board, teleports, endpoint)
-        dirty |= d
-        board, d = update_end(board, endpoint)
-        dirty |= d
-
-    if not any_snakes_exist(board):
-        raise MissionComplete()
-
-    return board, teleports, endpoint
+def move_board_state(board, teleports, endpoint, snake, direction):
+    """Move on a text grid, see ``move_state``."""
+    level = compile_level(board, teleports, endpoint)
+    state = move_state(level, from_grid(board, level), snake, direction)
+    return to_grid(state, level), teleports, endpoint
 
 
 if __name__ == '__main__':
     import sys
-    from board import load_file, draw_board
+    from board import load_file
+    from render import Renderer
     from textwrap import dedent
     board = load_file(sys.argv[1])
+    level = compile_level(*board)
+    state = from_grid(board[0], level)
+    # Only redraw what moved when there's a terminal to move around in,
+    # messages go below the board as part of the next frame
+    renderer = Renderer(level, diff=sys.stdout.isatty())
+    message = ''
     while True:
-        print(draw_board(*board))
+        renderer.update(state, message)
+        message = ''
         move = input('Choose a move (h for help)')
         if len(move) == 2:
             colors = {
@@ -384,26 +544,28 @@ if __name__ == '__main__':
             try:
                 color = colors[move[0]]
             except KeyError:
-                print(f"Invalid color {color}")
+                message = f"Invalid color {move[0]}"
                 continue
             try:
                 direction = directions[move[1]]
             except KeyError:
-                print(f"Invalid direction {direction}")
+                message = f"Invalid direction {move[1]}"
                 continue
             try:
-                board = move_board_state(*board, color, direction)
+                apply_move(level, state, color, direction)
             except UnsafeMove:
-                print("This kills the snake")
+                message = "This kills the snake"
             except IllegalMove:
-                print("Cant do that")
+                message = "Cant do that"
+            except InvalidMove:
+                message = "No such snake"
             except MissionComplete:
                 print("YOU'RE WINNER")
                 exit(0)
         elif move == 'q':
             exit(0)
         else:
-            print(dedent("""
+            message = dedent("""
             q to quit
 
             two letters to move, the first is the
@@ -411,5 +573,5 @@ if __name__ == '__main__':
             wasd direction to move. Valid snake colors
             are r, g, b. For example if you want to move
             the red snake up print 'rw'.
-            """))
+            """)
             continue
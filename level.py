@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from array import array
+from collections import deque
+
+from state import SPACE, SOLID, SPIKE, codes, zobrist_table
+
+
+directions = ['up', 'down', 'left', 'right']
+
+
+class Level:
+    """Everything about a level that never changes while playing it.
+
+    ``terrain`` holds the solid and spike cells, all other cells are space.
+    ``drop[idx]`` is how many free cells there are below ``idx`` before the
+    first terrain cell, and ``ground[idx]`` is that cell's code, or SPACE if
+    the column is open to the bottom of the board. ``step[direction][idx]``
+    is the neighbouring cell index, -1 off the board. ``portal[idx]`` is the
+    teleport paired with a teleport cell, -1 for every other cell.
+
+    Fruit never moves, ``fruit_distance[fruit]`` maps every cell to its
+    distance from that fruit going around the terrain, and ``end_distance``
+    does the same for the endpoint. Cells that can't get there at all are
+    ``width * height`` away. Both are only worked out when first used, as
+    is anything else kept in ``cache``.
+    """
+    __slots__ = ('width', 'height', 'terrain', 'endpoint', 'teleports',
+                 'drop', 'ground', 'step', 'zobrist', 'check_hash',
+                 'portal', 'fruit', '_fruit_distance', '_end_distance',
+                 'cache')
+
+    def __init__(self, width, height, terrain, endpoint, teleports,
+                 length=1, fruit=()):
+        self._start(width, height, terrain, endpoint, teleports, length,
+                    fruit)
+        area = width * height
+
+        # Teleports work in pairs, in the order they're listed
+        self.portal = array('i', [-1]) * area
+        for a, b in zip(teleports[::2], teleports[1::2]):
+            self.portal[a] = b
+            self.portal[b] = a
+
+        drop = array('i', [0]) * area
+        ground = bytearray(area)
+        for x in range(width):
+            free = 0
+            below = SPACE
+            for y in range(height - 1, -1, -1):
+                idx = y * width + x
+                drop[idx] = free
+                ground[idx] = below
+                if terrain[idx] == SPACE:
+                    free += 1
+                else:
+                    free = 0
+                    below = terrain[idx]
+        self.drop = drop
+        self.ground = bytes(ground)
+
+        self.step = {}
+        for direction in directions:
+            table = array('i', [-1]) * area
+            for idx in range(area):
+                y, x = divmod(idx, width)
+                if direction == 'left':
+                    x -= 1
+                elif direction == 'right':
+                    x += 1
+                elif direction == 'up':
+                    y -= 1
+                elif direction == 'down':
+                    y += 1
+                if 0 <= x < width and 0 <= y < height:
+                    table[idx] = y * width + x
+            self.step[direction] = table
+
+    @classmethod
+    def from_tables(cls, width, height, terrain, endpoint, teleports,
+                    length, fruit, drop, ground, step, portal):
+        """A level with its lookup tables already worked out.
+
+        For loading levels saved with their tables, see ``compiled.loads``.
+        """
+        self = cls.__new__(cls)
+        self._start(width, height, terrain, endpoint, teleports, length,
+                    fruit)
+        self.drop = drop
+        self.ground = bytes(ground)
+        self.step = step
+        self.portal = portal
+        return self
+
+    def _start(self, width, height, terrain, endpoint, teleports, length,
+               fruit):
+        # Everything but the lookup tables
+        self.width = width
+        self.height = height
+        self.terrain = bytes(terrain)
+        self.endpoint = endpoint
+        self.teleports = teleports
+        self.fruit = list(fruit)
+        self._fruit_distance = None
+        self._end_distance = None
+        self.cache = {}
+        self.zobrist = zobrist_table(width * height, length)
+        self.check_hash = False
+
+    @property
+    def fruit_distance(self):
+        if self._fruit_distance is None:
+            self._fruit_distance = {idx: self.distance_map(idx)
+                                    for idx in self.fruit}
+        return self._fruit_distance
+
+    @property
+    def end_distance(self):
+        if self._end_distance is None and self.endpoint >= 0:
+            self._end_distance = self.distance_map(self.endpoint)
+        return self._end_distance
+
+    def distance_map(self, source):
+        """Moves from every cell to ``source`` through non-terrain cells.
+
+        Going through a teleport doesn't cost anything extra.
+        """
+        area = self.width * self.height
+        distance = array('i', [area]) * area
+        distance[source] = 0
+        queue = deque([source])
+        terrain = self.terrain
+        portal = self.portal
+        steps = list(self.step.values())
+        while queue:
+            idx = queue.popleft()
+            t = portal[idx]
+            if t >= 0 and distance[t] > distance[idx]:
+                distance[t] = distance[idx]
+                queue.appendleft(t)
+            dist = distance[idx] + 1
+            for step in steps:
+                t = step[idx]
+                if t >= 0 and terrain[t] == SPACE and distance[t] > dist:
+                    distance[t] = dist
+                    queue.append(t)
+        return distance
+
+    def climb_map(self, target):
+        """Like ``distance_map``, but moving down is free.
+
+        Falling costs no moves, so this never overestimates how many moves
+        it takes to get any one cell to ``target``.
+        """
+        area = self.width * self.height
+        distance = array('i', [area]) * area
+        distance[target] = 0
+        queue = deque([target])
+        terrain = self.terrain
+        portal = self.portal
+        up = self.step['up']
+        steps = [self.step[d] for d in ('down', 'left', 'right')]
+        # 0-1 BFS backwards from the target, the cell above a cell gets to
+        # it by falling, and a teleport by going through its pair, so both
+        # go on the front of the queue
+        while queue:
+            idx = queue.popleft()
+            dist = distance[idx]
+            t = portal[idx]
+            if t >= 0 and distance[t] > dist:
+                distance[t] = dist
+                queue.appendleft(t)
+            t = up[idx]
+            if t >= 0 and terrain[t] == SPACE and distance[t] > dist:
+                distance[t] = dist
+                queue.appendleft(t)
+            for step in steps:
+                t = step[idx]
+                if t >= 0 and terrain[t] == SPACE and distance[t] > dist + 1:
+                    distance[t] = dist + 1
+                    queue.append(t)
+        return distance
+
+    def index(self, y, x):
+        return y * self.width + x
+
+    def coords(self, idx):
+        return divmod(idx, self.width)
+
+
+def compile_level(board, teleports, endpoint):
+    """Build the Level for a grid returned by ``board.load_board``.
+
+    Teleports and the endpoint are stored as cell indexes, -1 for no
+    endpoint. Teleports are paired up in the order ``load_board`` found
+    them.
+    """
+    height = len(board)
+    width = len(board[0]) if height else 0
+    terrain = bytearray(width * height)
+    length = 0
+    fruit = []
+    for y, row in enumerate(board):
+        for x, elem in enumerate(row):
+            code = codes.get(elem)
+            if code in (SOLID, SPIKE):
+                terrain[y * width + x] = code
+            elif elem == 'fruit' or elem.startswith('snake'):
+                # Longest a snake could ever grow to
+                length += 1
+                if elem == 'fruit':
+                    fruit.append(y * width + x)
+    end = endpoint[0] * width + endpoint[1] if endpoint else -1
+    teleports = [y * width + x for y, x in teleports]
+    return Level(width, height, terrain, end, teleports, max(length, 1),
+                 fruit)
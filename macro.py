@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Macro moves, whole walks of one snake as a single search edge.
+
+Most moves just walk a snake about without touching anything else, and
+the order they're made in doesn't matter to the rest of the board. So
+rather than queueing every step, each snake does a breadth first search
+of its own over moves that only move itself, and every position it can
+get to that way becomes one successor costing the moves it took. A move
+that does touch something else (pushes, eats, knocks something loose,
+leaves through the endpoint) ends its walk and is a successor too, so
+every sequence of single moves is still a sequence of macro moves.
+
+With only one snake on the board nothing else can make use of where it
+walks to, so only the moves that touch something are successors, and the
+positions it didn't get to walk on from when its walk is cut short.
+"""
+from collections import deque
+from time import perf_counter
+
+import game
+from search import try_move
+
+# Most positions each snake's walk looks at per expansion. Positions past
+# that are still queued as successors, they just aren't walked on from.
+walk_limit = 1000
+
+
+def touches(board, snake, code, log):
+    """Whether the move ``log`` undoes did anything but move ``snake``."""
+    if board.fruit != log.fruit or snake not in board.snakes:
+        return True
+    return any(body != code for body, _ in log.bodies)
+
+
+def macro_moves(level, board, stats, known=None, limit=None):
+    """Successors of a board, see ``search.single_moves``.
+
+    Yields every position a snake reaches by moving alone (if it's the
+    only snake, just those left unwalked past ``limit``), and every move
+    off one of those that touches anything else, as ``(moves, cost,
+    result, board)`` with ``cost`` the number of moves. Boards are copies
+    except for the touching moves, which are played on ``board`` in place
+    like ``single_moves`` does.
+
+    Positions ``known`` to the search already aren't walked on from, the
+    search has (or will) walk from them itself.
+    """
+    if limit is None:
+        limit = walk_limit
+    alone = len(board.snakes) == 1
+    for snake in list(board.snakes):
+        code = game.snake_codes[snake]
+        seen = {board.hash}
+        walk = deque([(board, '')])
+        while walk and len(seen) <= limit:
+            here, path = walk.popleft()
+            cost = len(path) // 2 + 1
+            for direction in 'wasd':
+                mv = path + snake[0] + direction
+                start = perf_counter()
+                result, log = try_move(level, here, mv[-2:])
+                stats.move_time += perf_counter() - start
+                if result == game.COMPLETE:
+                    yield mv, cost, result, None
+                    continue
+                if result != game.MOVED:
+                    stats.dead_ends[game.move_errors[result].__name__] += 1
+                    continue
+                if touches(here, snake, code, log):
+                    yield mv, cost, result, here
+                elif here.hash not in seen and \
+                        not (known and known(here, cost)):
+                    seen.add(here.hash)
+                    there = here.copy()
+                    walk.append((there, mv))
+                    if not alone:
+                        yield mv, cost, result, there
+                start = perf_counter()
+                game.undo(here, log)
+                stats.move_time += perf_counter() - start
+        if alone:
+            # Cut short, the search has to walk on from these itself
+            for there, path in walk:
+                if path:
+                    yield path, len(path) // 2, game.MOVED, there
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Level packs, many levels in one indexed file.
+
+A pack (``.sbp``) is a header, an index with one fixed size entry per
+level, a table of the levels' content hashes sorted by hash and then each
+level's text. The file is memory mapped and only the index entry and text
+of the level asked for are read, by its number in the pack (counting from
+1) or by its content hash, which is binary searched for in the table. The
+hash is ``cache.level_key`` of the loaded level, the same one solutions
+are cached under. Levels are referred to as ``pack.sbp#17``, or
+``pack.sbp#<hash>``, wherever a level file name goes.
+"""
+import mmap
+import os
+import struct
+from functools import lru_cache
+
+import board as gameboard
+from cache import level_key
+
+magic = b'SBP2'
+_header = struct.Struct('<4sI')
+# Offset and length of the level's text, and its content hash
+_entry = struct.Struct('<QI32s')
+# Content hash and level number, sorted by hash
+_hashed = struct.Struct('<32sI')
+
+
+class LevelPack:
+    """A pack file opened for reading, levels are numbered from 1."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < _header.size:
+            self.data.close()
+            raise ValueError(f"{path} isn't a level pack")
+        mark, self.count = _header.unpack_from(self.data)
+        if mark != magic:
+            self.data.close()
+            raise ValueError(f"{path} isn't a level pack")
+        self._table = _header.size + self.count * _entry.size
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _entry(self, number):
+        if not 1 <= number <= self.count:
+            raise IndexError(f"{self.path} has no level {number}")
+        return _entry.unpack_from(
+            self.data, _header.size + (number - 1) * _entry.size)
+
+    def key(self, number):
+        """Content hash of a level, as a hex digest."""
+        return self._entry(number)[2].hex()
+
+    def text(self, number):
+        offset, length, _ = self._entry(number)
+        return self.data[offset:offset + length].decode('utf-8')
+
+    def load(self, number):
+        """A level as returned by ``board.load_board``."""
+        return gameboard.load_board(self.text(number))
+
+    def find(self, key):
+        """Number of the level with a content hash, KeyError if none has."""
+        try:
+            digest = bytes.fromhex(key)
+        except ValueError:
+            raise KeyError(key) from None
+        low, high = 0, self.count
+        while low < high:
+            mid = (low + high) // 2
+            found, number = _hashed.unpack_from(
+                self.data, self._table + mid * _hashed.size)
+            if found < digest:
+                low = mid + 1
+            elif found > digest:
+                high = mid
+            else:
+                return number
+        raise KeyError(key)
+
+    def lookup(self, ref):
+        """Number of a level by number or hash, as after the ``#``."""
+        return int(ref) if ref.isdigit() else self.find(ref)
+
+
+def write_pack(path, texts):
+    """Write a pack of level texts, in order."""
+    texts = [text.encode('utf-8') for text in texts]
+    offset = _header.size + len(texts) * (_entry.size + _hashed.size)
+    index = []
+    keys = []
+    for number, text in enumerate(texts, 1):
+        key = bytes.fromhex(level_key(*gameboard.load_board(
+            text.decode('utf-8'))))
+        index.append(_entry.pack(offset, len(text), key))
+        keys.append((key, number))
+        offset += len(text)
+    with open(path, 'wb') as f:
+        f.write(_header.pack(magic, len(texts)))
+        f.writelines(index)
+        f.writelines(_hashed.pack(*entry) for entry in sorted(keys))
+        f.writelines(texts)
+
+
+def is_reference(name):
+    """Whether a level name is a ``pack.sbp#17`` style reference."""
+    path, _, ref = name.rpartition('#')
+    return path.endswith('.sbp') and bool(ref)
+
+
+@lru_cache(maxsize=8)
+def _opened(path, mtime, size):
+    return LevelPack(path)
+
+
+def open_pack(path):
+    """A LevelPack for a path, left open for later calls.
+
+    The same one is handed out again while the file doesn't change, so it
+    mustn't be closed.
+    """
+    stat = os.stat(path)
+    return _opened(path, stat.st_mtime_ns, stat.st_size)
+
+
+def load_reference(name):
+    """Load the level a ``pack.sbp#17`` style reference points at."""
+    path, _, ref = name.rpartition('#')
+    pack = open_pack(path)
+    return pack.load(pack.lookup(ref))
+
+
+def references(path):
+    """A reference to every level in a pack, in order."""
+    with LevelPack(path) as pack:
+        return [f'{path}#{number}' for number in range(1, len(pack) + 1)]
+
+
+if __name__ == '__main__':
+    import argparse
+    from batch import find_levels
+    parser = argparse.ArgumentParser(
+        description="Pack a directory of level files into one file")
+    parser.add_argument('directory', help="directory of level files")
+    parser.add_argument('output', help="pack file to write, e.g. levels.sbp")
+    args = parser.parse_args()
+    paths = find_levels(args.directory)
+    texts = []
+    for path in paths:
+        with open(path, 'r') as f:
+            texts.append(f.read())
+    write_pack(args.output, texts)
+    for number, path in enumerate(paths, 1):
+        print(f'{args.output}#{number}: {path}')
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Hash distributed A* (HDA*) over several processes.
+
+Every board state is owned by one worker, picked by its Zobrist hash, and
+only the owner keeps it in its open and closed sets. Successors owned by
+another worker are batched up and sent to it through its inbox queue.
+"""
+import heapq
+import itertools
+import multiprocessing
+import queue
+import time
+
+import game
+import level as gamelevel
+import state as gamestate
+from prune import Pruner
+from report import LimitReached
+from search import NoSolution, try_move, next_moves
+
+
+# Nodes expanded between flushing outboxes and reading the inbox
+batch_size = 64
+
+
+class _Shared:
+    """Counters and flags shared between the coordinator and the workers.
+
+    ``sent`` and ``received`` count message batches, they're only touched
+    with ``lock`` held, together with the workers' ``idle`` flags, so the
+    coordinator can tell when nothing is left in flight.
+    """
+
+    def __init__(self, ctx, workers):
+        self.lock = ctx.Lock()
+        self.sent = ctx.RawValue('q', 0)
+        self.received = ctx.RawValue('q', 0)
+        self.idle = ctx.RawArray('b', workers)
+        self.incumbent = ctx.RawValue('d', float('inf'))
+        self.done = ctx.Event()
+
+
+def _worker(index, grid, teleports, endpoint, heuristic, weight, optimal,
+            prune, inboxes, results, shared):
+    # Anything going wrong is passed on, or the coordinator would wait
+    # forever for this worker to go idle
+    try:
+        _search(index, grid, teleports, endpoint, heuristic, weight, optimal,
+                prune, inboxes, results, shared)
+    except Exception as e:
+        results.put(('error', index, f'{type(e).__name__}: {e}'))
+        for box in inboxes:
+            box.cancel_join_thread()
+
+
+def _search(index, grid, teleports, endpoint, heuristic, weight, optimal,
+            prune, inboxes, results, shared):
+    level = gamelevel.compile_level(grid, teleports, endpoint)
+    if prune:
+        prune = Pruner(level, gamestate.from_grid(grid, level))
+    workers = len(inboxes)
+    inbox = inboxes[index]
+    open_set = []
+    best_g = {}
+    counter = itertools.count()
+    outboxes = [[] for _ in range(workers)]
+    expanded = 0
+
+    def insert(g, moves, board):
+        key = board.hash
+        if best_g.get(key, g + 1) <= g:
+            return
+        best_g[key] = g
+        if prune and prune(board) is not None:
+            return
+        f = g + weight * heuristic(level, board)
+        if f < shared.incumbent.value:
+            heapq.heappush(open_set, (f, next(counter), g, moves, board))
+
+    while not shared.done.is_set():
+        # Take in whatever the other workers sent us, wait a little for it
+        # if there's nothing to do locally
+        batches = []
+        try:
+            if not open_set:
+                batches.append(inbox.get(timeout=0.01))
+            while True:
+                batches.append(inbox.get_nowait())
+        except queue.Empty:
+            pass
+        if batches:
+            with shared.lock:
+                shared.received.value += len(batches)
+                shared.idle[index] = 0
+            for batch in batches:
+                for g, moves, board in batch:
+                    insert(g, moves, board)
+
+        for _ in range(batch_size):
+            if not open_set:
+                break
+            f, _, g, moves, board = heapq.heappop(open_set)
+            if f >= shared.incumbent.value:
+                # Nothing left here can beat the solution we have
+                open_set.clear()
+                break
+            if g > best_g[board.hash]:
+                continue
+            expanded += 1
+            for mv in next_moves(board):
+                result, log = try_move(level, board, mv)
+                if result == game.COMPLETE:
+                    with shared.lock:
+                        if g + 1 < shared.incumbent.value:
+                            shared.incumbent.value = g + 1
+                            results.put(('solution', g + 1, moves + mv))
+                            if not optimal:
+                                shared.done.set()
+                    continue
+                if result != game.MOVED:
+                    continue
+                owner = board.hash % workers
+                if owner == index:
+                    insert(g + 1, moves + mv, board.copy())
+                else:
+                    outboxes[owner].append((g + 1, moves + mv, board.copy()))
+                game.undo(board, log)
+
+        for owner, batch in enumerate(outboxes):
+            if batch:
+                with shared.lock:
+                    shared.sent.value += 1
+                inboxes[owner].put(batch)
+                outboxes[owner] = []
+        if not open_set:
+            with shared.lock:
+                shared.idle[index] = 1
+
+    # Don't hang on exit over batches nobody will read
+    for box in inboxes:
+        box.cancel_join_thread()
+    results.put(('expanded', index, expanded))
+
+
+def solve(board, teleports, endpoint, workers=4, heuristic=None, weight=1,
+          optimal=True, time_limit=None, stats=None, prune=True):
+    """Solve a level with HDA* across ``workers`` processes.
+
+    With ``optimal`` set, the search only stops once no worker has a node
+    left with ``g + weight * h`` below the best solution found, so it's
+    optimal for an admissible heuristic at weight 1. Otherwise it stops at
+    the first solution. Per worker expansion counts are stored in the
+    ``stats`` dict if one is given. With ``prune`` set every worker drops
+    the dead states it's sent, see ``prune.Pruner``. A worker that fails or
+    dies raises RuntimeError.
+    """
+    if heuristic is None:
+        import solver
+        heuristic = solver.score_heuristic
+    ctx = multiprocessing.get_context()
+    shared = _Shared(ctx, workers)
+    inboxes = [ctx.Queue() for _ in range(workers)]
+    results = ctx.Queue()
+
+    level = gamelevel.compile_level(board, teleports, endpoint)
+    root = gamestate.from_grid(board, level)
+    with shared.lock:
+        shared.sent.value += 1
+    inboxes[root.hash % workers].put([(0, '', root)])
+
+    procs = [ctx.Process(target=_worker,
+                         args=(i, board, teleports, endpoint, heuristic,
+                               weight, optimal, prune, inboxes, results,
+                               shared))
+             for i in range(workers)]
+    for proc in procs:
+        proc.start()
+
+    start = time.monotonic()
+    solution = None
+    expanded = {}
+    try:
+        while not shared.done.is_set():
+            try:
+                kind, cost, moves = results.get(timeout=0.01)
+                if kind == 'error':
+                    raise RuntimeError(f"Worker {cost} failed, {moves}")
+                if kind == 'solution' and \
+                        (solution is None or cost < solution[0]):
+                    solution = cost, moves
+            except queue.Empty:
+                pass
+            for i, proc in enumerate(procs):
+                if proc.exitcode not in (None, 0):
+                    raise RuntimeError(f"Worker {i} exited with code "
+                                       f"{proc.exitcode}")
+            with shared.lock:
+                if all(shared.idle) and \
+                        shared.sent.value == shared.received.value:
+                    shared.done.set()
+            if time_limit is not None and \
+                    time.monotonic() - start > time_limit:
+                raise LimitReached(f"Searched for over {time_limit}s")
+    finally:
+        shared.done.set()
+        while len(expanded) < workers and any(p.is_alive() for p in procs):
+            try:
+                kind, a, b = results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if kind == 'expanded':
+                expanded[a] = b
+            elif kind == 'solution' and (solution is None or a < solution[0]):
+                solution = a, b
+        for proc in procs:
+            proc.join()
+        if stats is not None:
+            stats['expanded'] = [expanded.get(i, 0) for i in range(workers)]
+
+    if solution is None:
+        raise NoSolution()
+    return solution[1]
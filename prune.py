@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Spotting states the level can't be finished from any more.
+
+Every rule here is exact, a state is only called dead when no sequence of
+moves could finish the level from it, so pruning never costs a solution
+or an optimal one.
+"""
+from collections import deque
+from array import array
+
+from state import SPACE, FRUIT
+
+
+rules = ('fruit_pocket', 'exit_pocket', 'snake_wedged', 'block_lost')
+
+
+def support_map(level):
+    """Distance from each cell to the nearest cell something could rest in.
+
+    That's any free cell right above terrain or fruit, going through free
+    cells only. Cached on the level.
+    """
+    support = level.cache.get('support')
+    if support is not None:
+        return support
+    area = level.width * level.height
+    terrain = level.terrain
+    below = level.step['down']
+    fruit = set(level.fruit)
+    support = array('i', [area]) * area
+    queue = deque()
+    for idx in range(area):
+        t = below[idx]
+        if terrain[idx] == SPACE and t >= 0 and \
+                (terrain[t] != SPACE or t in fruit):
+            support[idx] = 0
+            queue.append(idx)
+    steps = list(level.step.values())
+    while queue:
+        idx = queue.popleft()
+        dist = support[idx] + 1
+        for step in steps:
+            t = step[idx]
+            if t >= 0 and terrain[t] == SPACE and support[t] > dist:
+                support[t] = dist
+                queue.append(t)
+    level.cache['support'] = support
+    return support
+
+
+class Pruner:
+    """Calling it with a state returns the rule it breaks, None if it's fine.
+
+    Rules:
+
+    - ``fruit_pocket``: a fruit is in a pocket of free cells no head is in.
+    - ``exit_pocket``: a snake can't get its head to the endpoint.
+    - ``snake_wedged``: a fruit is too far from anything a snake could
+      stand on for the snakes and blocks to reach it, even stacked up.
+    - ``block_lost``: the same, but only because blocks fell off the board.
+
+    The reach is measured from ``support_map``. Everything on the board
+    rests on terrain or fruit through a chain of touching bodies, so a head
+    is never further from a resting cell than the bodies could bridge,
+    which is at most one step of the walk per segment, however the body is
+    bent around the terrain. ``root`` is the state the search starts from,
+    blocks are rigid so their sizes are taken from it.
+    """
+
+    def __init__(self, level, root):
+        self.level = level
+        self.support = support_map(level)
+        self.spans = {code: len(segments)
+                      for code, segments in root.blocks.items()}
+        self.all_blocks = sum(self.spans.values())
+
+    def __call__(self, board):
+        level = self.level
+        cells = board.cells
+        heads = [segments[0] for segments in board.snakes.values()]
+        if not heads:
+            return None
+        end_distance = level.end_distance
+        area = level.width * level.height
+        if end_distance is not None:
+            for head in heads:
+                if end_distance[head] == area:
+                    return 'exit_pocket'
+
+        fruit = [idx for idx in level.fruit if cells[idx] == FRUIT]
+        if not fruit:
+            return None
+        fruit_distance = level.fruit_distance
+        for idx in fruit:
+            distance = fruit_distance[idx]
+            if all(distance[head] == area for head in heads):
+                return 'fruit_pocket'
+
+        # Snakes can still grow by every fruit that's left
+        reach = len(fruit)
+        for segments in board.snakes.values():
+            reach += len(segments)
+        blocks = 0
+        for code in board.blocks:
+            blocks += self.spans[code]
+        support = self.support
+        for idx in fruit:
+            if support[idx] > reach + blocks:
+                if support[idx] <= reach + self.all_blocks:
+                    return 'block_lost'
+                return 'snake_wedged'
+        return None
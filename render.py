@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Drawing packed states to a terminal, quickly.
+
+Glyphs for every cell code, the snake heads and the static part of the
+level (terrain, endpoint and teleports) are worked out once per Renderer,
+so drawing a state is a lookup per cell. ``draw`` gives the same text as
+``board.draw_board``. In diff mode ``update`` only sends the cells that
+changed since the last frame, moving the cursor to each run of them, and
+every frame goes out in a single write, along with any status message
+shown below the board.
+"""
+import sys
+import time
+
+import game
+from board import boardtable, specials_lut, COLOR_RST
+from state import kinds, snake_codes
+
+
+def _glyph(entry, color, fancy):
+    _, symbol, fancy_symbol, ansi = entry
+    glyph = fancy_symbol if fancy else symbol
+    if color and ansi:
+        return ansi + glyph + COLOR_RST
+    return glyph
+
+
+class Renderer:
+    """Draws states of one level to ``stream``.
+
+    ``color`` and ``fancy`` work as for ``board.draw_board``. With ``diff``
+    set each frame only redraws what changed since the previous one, the
+    board is drawn from the top left corner of the terminal and the cursor
+    left on the line below it.
+    """
+
+    def __init__(self, level, stream=sys.stdout, color=True, fancy=True,
+                 diff=False):
+        self.level = level
+        self.stream = stream
+        self.diff = diff
+        self.last = None
+        table = {entry[0]: entry for entry in boardtable}
+        self.glyphs = [_glyph(table[kind], color, fancy) for kind in kinds]
+        self.heads = {code: _glyph(table[f'snake {color_name} 0'], color,
+                                   fancy)
+                      for color_name, code in snake_codes.items()}
+        special = 1 if fancy else 0
+        base = [self.glyphs[code] for code in level.terrain]
+        for idx in level.teleports:
+            base[idx] = specials_lut['teleport'][special]
+        if level.endpoint >= 0:
+            base[level.endpoint] = specials_lut['endpoint'][special]
+        self.base = base
+
+    def frame(self, state):
+        """Glyph of every cell of a state, row major."""
+        glyphs = self.glyphs
+        cells = [glyphs[code] if code else background
+                 for code, background in zip(state.cells, self.base)]
+        heads = self.heads
+        for color, segments in state.snakes.items():
+            cells[segments[0]] = heads[snake_codes[color]]
+        return cells
+
+    def draw(self, state):
+        """The whole board as text, like ``board.draw_board``."""
+        cells = self.frame(state)
+        width = self.level.width
+        return '\n'.join(''.join(cells[start:start + width])
+                         for start in range(0, len(cells), width))
+
+    def update(self, state, status=''):
+        """Write a frame, only the changes since the last one in diff mode.
+
+        ``status`` is written on the lines below the board. In diff mode the
+        frame after one with a status is drawn in full, in case the status
+        scrolled the terminal.
+        """
+        if status:
+            status += '\n'
+        if not self.diff:
+            self.stream.write(self.draw(state) + '\n' + status)
+            self.stream.flush()
+            return
+        cells = self.frame(state)
+        width = self.level.width
+        height = self.level.height
+        last = self.last
+        if last is None:
+            # Clear the screen and draw everything
+            out = ['\033[2J\033[H', self.draw(state), '\n']
+        else:
+            out = []
+            for y in range(height):
+                start = y * width
+                if cells[start:start + width] == last[start:start + width]:
+                    continue
+                x = 0
+                while x < width:
+                    if cells[start + x] == last[start + x]:
+                        x += 1
+                        continue
+                    end = x + 1
+                    while end < width and \
+                            cells[start + end] != last[start + end]:
+                        end += 1
+                    out.append(f'\033[{y + 1};{x + 1}H')
+                    out.extend(cells[start + x:start + end])
+                    x = end
+            # Back below the board, clearing anything written there
+            out.append(f'\033[{height + 1};1H\033[J')
+        out.append(status)
+        self.last = None if status else cells
+        self.stream.write(''.join(out))
+        self.stream.flush()
+
+
+def play(level, state, moves, delay=0.2, **options):
+    """Animate a move string being played from a state.
+
+    The last frame is the level finished, if the moves finish it. The
+    state is left as it was. Options are passed on to Renderer, ``diff``
+    defaults to on.
+    """
+    from search import colors, directions
+    options.setdefault('diff', True)
+    renderer = Renderer(level, **options)
+    board = state.copy()
+    renderer.update(board)
+    for i in range(0, len(moves), 2):
+        time.sleep(delay)
+        result, _ = game.try_move(level, board, colors[moves[i]],
+                                  directions[moves[i + 1]], keep=True)
+        if result not in (game.MOVED, game.COMPLETE):
+            break
+        renderer.update(board)
+        if result == game.COMPLETE:
+            break
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import collections
+import contextlib
+import sys
+import time
+
+
+class LimitReached(Exception):
+    """The search went over its node or time limit."""
+
+
+class Reporter:
+    """Progress reporting for the search, quiet unless asked otherwise.
+
+    With ``interval`` set, a one line summary (nodes/s, frontier and closed
+    set sizes, best heuristic value so far) is written to ``stream`` at
+    most once every ``interval`` seconds. ``trace`` gets every expanded
+    node, it's either a callable taking ``(node, board, score, h)`` or a
+    file object that gets one tab separated line per node.
+
+    ``node_limit`` and ``time_limit`` (in seconds) stop the search by
+    raising LimitReached, the time limit is only checked every
+    ``check_every`` expansions.
+    """
+    # Expansions between looking at the clock
+    check_every = 256
+
+    def __init__(self, interval=None, stream=sys.stderr, trace=None,
+                 node_limit=None, time_limit=None):
+        self.interval = interval
+        self.stream = stream
+        self.trace = trace
+        self.node_limit = node_limit
+        self.time_limit = time_limit
+        self.expanded = 0
+        self.best_h = float('inf')
+        self.start = self.last_time = time.monotonic()
+        self.last_expanded = 0
+        self._countdown = self.check_every
+
+    def expand(self, node, board, score, h, frontier, closed):
+        """Called by the search for every node it expands."""
+        self.expanded += 1
+        if h < self.best_h:
+            self.best_h = h
+        if self.trace is not None:
+            if callable(self.trace):
+                self.trace(node, board, score, h)
+            else:
+                self.trace.write(
+                    f"{self.expanded}\t{node.g}\t{score}\t{h}\t"
+                    f"{node.moves()}\n")
+        if self.node_limit is not None and self.expanded > self.node_limit:
+            raise LimitReached(f"Expanded over {self.node_limit} nodes")
+        self._countdown -= 1
+        if self._countdown:
+            return
+        self._countdown = self.check_every
+        now = time.monotonic()
+        if self.time_limit is not None and \
+                now - self.start > self.time_limit:
+            raise LimitReached(f"Searched for over {self.time_limit}s")
+        if self.interval is not None and \
+                now - self.last_time >= self.interval:
+            self.summary(now, frontier, closed)
+
+    def summary(self, now, frontier, closed):
+        rate = (self.expanded - self.last_expanded) / (now - self.last_time)
+        self.stream.write(
+            f"[{now - self.start:7.1f}s] {self.expanded} expanded "
+            f"({rate:.0f} nodes/s), frontier {frontier}, closed {closed}, "
+            f"best h {self.best_h}\n")
+        self.stream.flush()
+        self.last_time = now
+        self.last_expanded = self.expanded
+
+    def finish(self, goal):
+        """Called once the search is over, ``goal`` is None on failure."""
+        if self.interval is None:
+            return
+        elapsed = time.monotonic() - self.start
+        result = f"{goal.g} moves" if goal is not None else "no solution"
+        self.stream.write(
+            f"[{elapsed:7.1f}s] done, {result} after {self.expanded} "
+            f"expansions\n")
+        self.stream.flush()
+
+
+class Stats:
+    """Counters the search fills in as it runs.
+
+    ``generated`` counts successors that were legal moves, ``duplicates``
+    the ones already reached at no greater cost and ``pruned`` the ones cut
+    off without being queued, ``prune_rules`` counts dead states by the
+    rule that spotted them. Moves that raised are counted per exception
+    name in ``dead_ends``. ``cache_hits`` and ``cache_misses`` count nodes
+    that did or didn't keep their state, ``replayed`` the moves played to
+    rebuild the misses. ``endgames`` counts expanded states the endgame
+    search found a way out of.
+
+    Times are in seconds. Hashes are updated incrementally as moves are
+    applied, so ``move_time`` includes them and ``hash_time`` is the
+    closed set lookup.
+    """
+
+    def __init__(self):
+        self.expanded = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.pruned = 0
+        self.prune_rules = collections.Counter()
+        self.dead_ends = collections.Counter()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.replayed = 0
+        self.endgames = 0
+        self.move_time = 0.0
+        self.hash_time = 0.0
+        self.heuristic_time = 0.0
+        self.peak_frontier = 0
+        self.peak_closed = 0
+
+    def sizes(self, frontier, closed):
+        if frontier > self.peak_frontier:
+            self.peak_frontier = frontier
+        if closed > self.peak_closed:
+            self.peak_closed = closed
+
+    @property
+    def cache_rate(self):
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 1.0
+
+    def as_dict(self):
+        stats = dict(vars(self))
+        stats['dead_ends'] = dict(self.dead_ends)
+        stats['prune_rules'] = dict(self.prune_rules)
+        stats['cache_rate'] = self.cache_rate
+        return stats
+
+    def __str__(self):
+        dead_ends = ', '.join(f"{name} {count}" for name, count
+                              in sorted(self.dead_ends.items())) or 'none'
+        prune_rules = ', '.join(f"{name} {count}" for name, count
+                                in sorted(self.prune_rules.items())) or 'none'
+        return (
+            f"expanded {self.expanded}, generated {self.generated}, "
+            f"duplicates {self.duplicates}, pruned {self.pruned}, "
+            f"endgames {self.endgames}\n"
+            f"dead ends: {dead_ends}\n"
+            f"dead states: {prune_rules}\n"
+            f"state cache {self.cache_rate:.1%} hits, "
+            f"{self.replayed} moves replayed\n"
+            f"time: moves {self.move_time:.2f}s, "
+            f"hashing {self.hash_time:.2f}s, "
+            f"heuristic {self.heuristic_time:.2f}s\n"
+            f"peak frontier {self.peak_frontier}, "
+            f"peak closed {self.peak_closed}")
+
+
+@contextlib.contextmanager
+def profiled(stream=sys.stderr, cpu=True, memory=False, limit=20):
+    """Profile the body of a with block, results are written to ``stream``.
+
+    ``cpu`` runs it under cProfile and prints the ``limit`` most expensive
+    functions by cumulative time, ``memory`` traces allocations with
+    tracemalloc and prints the peak and the ``limit`` biggest allocation
+    sites still alive at the end.
+    """
+    profile = None
+    if cpu:
+        import cProfile
+        profile = cProfile.Profile()
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+    if profile is not None:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+            import pstats
+            pstats.Stats(profile, stream=stream) \
+                .sort_stats('cumulative').print_stats(limit)
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            stream.write(f"peak traced memory {peak / 1024:.0f} KiB\n")
+            for stat in snapshot.statistics('lineno')[:limit]:
+                stream.write(f"{stat}\n")
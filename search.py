@@ -0,0 +1,490 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import heapq
+import itertools
+from functools import partial
+from time import perf_counter
+
+import game
+from report import Reporter, Stats
+
+
+class NoSolution(Exception):
+    """The search ran out of states without finishing the level."""
+
+
+colors = {
+    'r': 'red',
+    'g': 'grn',
+    'b': 'blu'}
+directions = {
+    'w': 'up',
+    'a': 'left',
+    's': 'down',
+    'd': 'right'}
+
+# Exceptions that just mean a move isn't worth following
+dead_ends = (game.InvalidMove, game.IllegalMove, game.UnsafeMove)
+
+
+def apply_move(level, board, move):
+    """Apply a move string in place, returns the log to undo it with."""
+    color = colors[move[0]]
+    direction = directions[move[1]]
+    return game.apply_move(level, board, color, direction)
+
+
+def try_move(level, board, move):
+    """Like apply_move, but returns ``(result, log)`` instead of raising.
+
+    See ``game.try_move``, the board is only changed when the result is
+    ``game.MOVED``.
+    """
+    return game.try_move(level, board, colors[move[0]], directions[move[1]])
+
+
+def play(level, board, moves):
+    """Apply a string of one or more moves in place."""
+    for i in range(0, len(moves), 2):
+        apply_move(level, board, moves[i:i + 2])
+
+
+def next_moves(board):
+    """Every move string that could be played on a board."""
+    return [color[0] + direction
+            for color in board.snakes for direction in 'wasd']
+
+
+def single_moves(level, board, stats, known=None):
+    """Successors of a board, one move each.
+
+    Yields ``(moves, cost, result, board)`` for every move that's MOVED or
+    COMPLETE, counting the rest in ``stats``. Moves are played on ``board``
+    in place and only undone once the next one is asked for, so it has to
+    be copied to be kept. It's None for moves that finish the level.
+
+    ``known(board, cost)`` says whether the search already has a board at
+    no more than ``cost`` moves from this one, generators that look
+    further ahead can use it to stop early.
+    """
+    for mv in next_moves(board):
+        start = perf_counter()
+        result, log = try_move(level, board, mv)
+        stats.move_time += perf_counter() - start
+        if result == game.COMPLETE:
+            yield mv, 1, result, None
+        elif result == game.MOVED:
+            yield mv, 1, result, board
+            start = perf_counter()
+            game.undo(board, log)
+            stats.move_time += perf_counter() - start
+        else:
+            stats.dead_ends[game.move_errors[result].__name__] += 1
+
+
+# Every move as ``(snake, direction)`` for game.expand_batch, and its name
+batch_names = [color + direction for color in colors for direction in 'wasd']
+batch_order = [(colors[name[0]], directions[name[1]]) for name in batch_names]
+
+
+def batch_moves(level, boards, stats, skip=None):
+    """Try every move on several boards at once, with ``game.expand_batch``.
+
+    Returns a list per board of ``(move, result, hash, board)`` for every
+    move of a snake it has, for ``batched_moves`` to go through. ``board``
+    is a copy of the new state for MOVED moves, unless ``skip(i, hash)``
+    said it isn't wanted from board ``i``, and None otherwise.
+    """
+    start = perf_counter()
+    results, hashes, moved = game.expand_batch(level, boards, batch_order,
+                                               skip)
+    stats.move_time += perf_counter() - start
+    count = len(batch_names)
+    found = []
+    for i, board in enumerate(boards):
+        moves = []
+        for j, mv in enumerate(batch_names):
+            if colors[mv[0]] in board.snakes:
+                k = i * count + j
+                moves.append((mv, results[k], hashes[k], moved[k]))
+        found.append(moves)
+    return found
+
+
+def batched_moves(level, board, found, stats, duplicate=None):
+    """``single_moves`` for a board, from what ``batch_moves`` found for it.
+
+    Copies the batch made are yielded as they are. MOVED states it didn't
+    copy are played again on ``board`` in place, except the ones
+    ``duplicate(hash)`` says the search has already, which are only
+    counted.
+    """
+    for mv, result, board_hash, there in found:
+        if result == game.COMPLETE:
+            yield mv, 1, result, None
+        elif result != game.MOVED:
+            stats.dead_ends[game.move_errors[result].__name__] += 1
+        elif there is not None:
+            yield mv, 1, result, there
+        elif duplicate is not None and duplicate(board_hash):
+            stats.generated += 1
+            stats.duplicates += 1
+        else:
+            start = perf_counter()
+            result, log = try_move(level, board, mv)
+            stats.move_time += perf_counter() - start
+            yield mv, 1, result, board
+            start = perf_counter()
+            game.undo(board, log)
+            stats.move_time += perf_counter() - start
+
+
+class Node:
+    """A search node, reached from ``parent`` by playing ``move``.
+
+    ``move`` may be several moves, which ``cost`` says how many of. ``g``
+    is the number of moves from the root. ``state`` may be None when
+    the solver is over its state budget, it's then rebuilt from the nearest
+    ancestor that kept one. Goal nodes have no state and a ``key`` of None.
+    """
+    __slots__ = ('state', 'parent', 'move', 'depth', 'g', 'key')
+
+    def __init__(self, state, parent, move, key, cost=1):
+        self.state = state
+        self.parent = parent
+        self.move = move
+        if parent is None:
+            self.depth = self.g = 0
+        else:
+            self.depth = parent.depth + 1
+            self.g = parent.g + cost
+        self.key = key
+
+    def moves(self):
+        """The full move string from the root to this node."""
+        moves = []
+        node = self
+        while node.parent is not None:
+            moves.append(node.move)
+            node = node.parent
+        return ''.join(reversed(moves))
+
+
+def move_to_board(node, level, stats=None):
+    """The state of a node, replayed from an ancestor if it wasn't kept."""
+    if node.state is not None:
+        if stats is not None:
+            stats.cache_hits += 1
+        return node.state
+    moves = []
+    while node.state is None:
+        moves.append(node.move)
+        node = node.parent
+    if stats is not None:
+        stats.cache_misses += 1
+        stats.replayed += len(moves)
+    board = node.state.copy()
+    for move in reversed(moves):
+        play(level, board, move)
+    return board
+
+
+def best_first(level, root, heuristic, priority, max_states=1000000,
+               checkpoint=8, reporter=None, stats=None, prune=None,
+               canonical=None, expand=single_moves, endgame=None,
+               batch=1):
+    """Generic best first search, nodes are expanded lowest priority first.
+
+    ``priority(g, h)`` orders the frontier, ``heuristic`` may be None when
+    the priority doesn't use it. A move that finishes the level is queued as
+    a goal node and only returned once it's popped, so strategies that
+    expand in order of true cost return optimal solutions.
+
+    At most ``max_states`` nodes keep their state in memory. Past that only
+    every ``checkpoint``-th level of the tree does, so rebuilding any other
+    node replays fewer than ``checkpoint`` moves. Every expansion is passed
+    to ``reporter`` and counted in ``stats``.
+
+    ``prune`` is called on every new board, boards it returns a rule name
+    for are dead and dropped (see ``prune.Pruner``). ``canonical`` maps a
+    board to its closed set key in place of its hash, boards with the same
+    key are taken to be equivalent (see ``symmetry.Canonical``).
+
+    ``expand`` generates successors, see ``single_moves``. Successors may
+    be several moves at once as long as it gives their real cost.
+
+    ``endgame(level, board, stats)`` may return moves that finish the level
+    from an expanded board, they're queued as a goal node at their real
+    cost (see ``endgame.endgame``).
+
+    With ``batch`` over 1 up to that many nodes are popped at once and
+    their single moves all played in one ``batch_moves`` call, in place of
+    ``expand``. A goal node only comes off the queue at the head of a
+    batch, so it's still never returned ahead of a cheaper one. The batch
+    only copies new states that fit in the state budget, nodes bettered
+    by one earlier in the batch aren't counted as expanded.
+    """
+    if batch > 1 and expand is not single_moves:
+        raise ValueError("batches only expand single moves")
+    if reporter is None:
+        reporter = Reporter()
+    if stats is None:
+        stats = Stats()
+    # Cheapest cost each board has been reached with (key -> g)
+    best_g = {root.key: 0}
+    # Boards we need to deal with (priorty queue of search nodes)
+    open_set = []
+    counter = itertools.count()
+    h = heuristic(level, root.state) if heuristic else 0
+    heapq.heappush(open_set, (priority(0, h), next(counter), h, root))
+    stored = 1
+
+    def duplicate(node, board_hash):
+        return best_g.get(board_hash, node.g + 2) <= node.g + 1
+
+    def skip(i, board_hash):
+        # Only copy states that are new and will be kept
+        node = nodes[i][3]
+        if not canonical and duplicate(node, board_hash):
+            return True
+        return stored >= max_states and (node.depth + 1) % checkpoint != 0
+
+    while open_set:
+        nodes = []
+        while open_set and len(nodes) < batch:
+            entry = heapq.heappop(open_set)
+            if entry[3].key is None:
+                if not nodes:
+                    return entry[3]  # Done! Horray
+                # Nodes in this batch could still lead somewhere cheaper
+                heapq.heappush(open_set, entry)
+                break
+            if entry[3].g > best_g[entry[3].key]:
+                continue  # Already reached on a route that's better
+            nodes.append(entry)
+        boards = [move_to_board(entry[3], level, stats) for entry in nodes]
+        if batch > 1:
+            batched = batch_moves(level, boards, stats, skip)
+
+        for i, (cur_score, _, cur_h, cur_node) in enumerate(nodes):
+            if cur_node.g > best_g[cur_node.key]:
+                continue  # Bettered by a node earlier in the batch
+            cur_board = boards[i]
+            stats.expanded += 1
+            stats.sizes(len(open_set), len(best_g))
+            reporter.expand(cur_node, cur_board, cur_score, cur_h,
+                            len(open_set), len(best_g))
+            finish = endgame(level, cur_board, stats) if endgame else None
+            if finish:
+                cost = len(finish) // 2
+                goal = Node(None, cur_node, finish, None, cost)
+                heapq.heappush(open_set, (priority(cur_node.g + cost, 0),
+                                          next(counter), 0, goal))
+
+            # Successors may be played on cur_board in place and undone
+            # again, only the ones we keep get copied. Batched ones are
+            # copies already unless the batch left them out.
+            def known(board, cost):
+                key = canonical(board) if canonical else board.hash
+                return best_g.get(key, cur_node.g + cost + 1) <= \
+                    cur_node.g + cost
+
+            if batch > 1:
+                successors = batched_moves(
+                    level, cur_board, batched[i], stats,
+                    None if canonical else partial(duplicate, cur_node))
+            else:
+                successors = expand(level, cur_board, stats, known)
+            for mv, cost, result, board in successors:
+                g = cur_node.g + cost
+                if result == game.COMPLETE:
+                    goal = Node(None, cur_node, mv, None, cost)
+                    heapq.heappush(open_set,
+                                   (priority(g, 0), next(counter), 0, goal))
+                    continue
+                stats.generated += 1
+                start = perf_counter()
+                key = canonical(board) if canonical else board.hash
+                better = best_g.get(key, g + 1) > g
+                if better:
+                    best_g[key] = g
+                stats.hash_time += perf_counter() - start
+                rule = prune(board) if better and prune else None
+                if rule is not None:
+                    stats.pruned += 1
+                    stats.prune_rules[rule] += 1
+                elif better:
+                    keep = stored < max_states or \
+                        (cur_node.depth + 1) % checkpoint == 0
+                    if keep and (batch == 1 or board is cur_board):
+                        board = board.copy()
+                    next_node = Node(board if keep else None,
+                                     cur_node, mv, key, cost)
+                    stored += keep
+                    start = perf_counter()
+                    h = heuristic(level, board) if heuristic else 0
+                    stats.heuristic_time += perf_counter() - start
+                    heapq.heappush(open_set, (priority(g, h), next(counter),
+                                              h, next_node))
+                else:
+                    stats.duplicates += 1
+
+            if stored >= max_states and cur_node.depth % checkpoint:
+                # Over budget, only checkpoints hold on to their states
+                if cur_node.state is not None:
+                    stored -= 1
+                cur_node.state = None
+
+    raise NoSolution()
+
+
+def _no_weight(name, weight):
+    # A weight of 1 doesn't change anything, so it's allowed
+    if weight not in (None, 1):
+        raise ValueError(f"{name} doesn't use a heuristic weight")
+
+
+def astar(level, root, heuristic, weight=None, **options):
+    """A*, optimal as long as the heuristic never overestimates."""
+    _no_weight('astar', weight)
+    return best_first(level, root, heuristic, lambda g, h: g + h, **options)
+
+
+def weighted_astar(level, root, heuristic, weight=2, **options):
+    """A* with the heuristic scaled by ``weight``.
+
+    Solutions are at most ``weight`` times longer than optimal with an
+    admissible heuristic, in exchange for expanding far fewer nodes.
+    """
+    return best_first(level, root, heuristic,
+                      lambda g, h: g + weight * h, **options)
+
+
+def greedy(level, root, heuristic, weight=None, **options):
+    """Pure greedy best first, ignores how many moves a node took."""
+    _no_weight('greedy', weight)
+    return best_first(level, root, heuristic, lambda g, h: h, **options)
+
+
+def breadth_first(level, root, heuristic, weight=None, **options):
+    """Breadth first, shortest solutions without needing a heuristic."""
+    _no_weight('bfs', weight)
+    return best_first(level, root, None, lambda g, h: g, **options)
+
+
+def ida_star(level, root, heuristic, weight=1, max_states=1000000,
+             reporter=None, stats=None, prune=None, canonical=None,
+             **options):
+    """Iterative deepening A*, memory bound by the solution length.
+
+    Runs depth first searches on a single board that's modified in place,
+    each one bounded by ``g + weight * h``, raising the bound to the lowest
+    value that went over it until a solution is found. Up to ``max_states``
+    boards are remembered with the cost they were reached at to prune
+    transpositions within an iteration. ``prune`` and ``canonical`` work as
+    in best_first.
+    """
+    if reporter is None:
+        reporter = Reporter()
+    if stats is None:
+        stats = Stats()
+    board = move_to_board(root, level).copy()
+    bound = weight * heuristic(level, board)
+    while True:
+        goal, bound = _bounded_dfs(level, root, board, heuristic, weight,
+                                   bound, max_states, reporter, stats, prune,
+                                   canonical)
+        if goal is not None:
+            return goal
+        if bound == float('inf'):
+            raise NoSolution()
+
+
+def _bounded_dfs(level, root, board, heuristic, weight, bound, max_states,
+                 reporter, stats, prune, canonical):
+    minimum = float('inf')
+    seen = {root.key: 0}
+    path = [root]
+    logs = []
+    stack = [iter(next_moves(board))]
+    stats.expanded += 1
+    reporter.expand(root, board, bound, heuristic(level, board),
+                    len(path), len(seen))
+
+    while stack:
+        node = path[-1]
+        mv = next(stack[-1], None)
+        if mv is None:
+            # Done with this node, back up to its parent
+            stack.pop()
+            path.pop()
+            if logs:
+                start = perf_counter()
+                game.undo(board, logs.pop())
+                stats.move_time += perf_counter() - start
+            continue
+
+        g = node.g + 1
+        start = perf_counter()
+        result, log = try_move(level, board, mv)
+        stats.move_time += perf_counter() - start
+        if result == game.COMPLETE:
+            if g <= bound:
+                return Node(None, node, mv, None), bound
+            minimum = min(minimum, g)
+            continue
+        if result != game.MOVED:
+            stats.dead_ends[game.move_errors[result].__name__] += 1
+            continue
+        stats.generated += 1
+
+        start = perf_counter()
+        key = canonical(board) if canonical else board.hash
+        duplicate = seen.get(key, g + 1) <= g
+        stats.hash_time += perf_counter() - start
+        rule = prune(board) if prune and not duplicate else None
+        if rule is not None:
+            stats.pruned += 1
+            stats.prune_rules[rule] += 1
+            if len(seen) < max_states:
+                seen[key] = -1  # Dead whatever it costs to get here
+            start = perf_counter()
+            game.undo(board, log)
+            stats.move_time += perf_counter() - start
+            continue
+        start = perf_counter()
+        h = heuristic(level, board)
+        stats.heuristic_time += perf_counter() - start
+        f = g + weight * h
+        if duplicate or f > bound:
+            if f > bound:
+                minimum = min(minimum, f)
+            if duplicate:
+                stats.duplicates += 1
+            else:
+                stats.pruned += 1
+            start = perf_counter()
+            game.undo(board, log)
+            stats.move_time += perf_counter() - start
+            continue
+        if len(seen) < max_states:
+            seen[key] = g
+
+        child = Node(None, node, mv, key)
+        path.append(child)
+        stats.expanded += 1
+        stats.sizes(len(path), len(seen))
+        reporter.expand(child, board, f, h, len(path), len(seen))
+        logs.append(log)
+        stack.append(iter(next_moves(board)))
+
+    return None, minimum
+
+
+strategies = {
+    'astar': astar,
+    'wastar': weighted_astar,
+    'greedy': greedy,
+    'bfs': breadth_first,
+    'idastar': ida_star,
+}
@@ -1,54 +1,61 @@
 import game
 import board as gameboard
-import re
-import itertools
-import heapq
-import hashlib
-
-
-def score_heuristic(board, teleports, endpoint, cur_move):
+import state as gamestate
+import level as gamelevel
+import search
+import sys
+from admissible import reach_heuristic, pdb_heuristic
+from prune import Pruner
+from symmetry import Canonical
+from macro import macro_moves
+from endgame import endgame as endgame_search
+from report import Reporter, Stats, profiled
+from render import Renderer
+
+
+def score_heuristic(level, board):
     cost_live_snake = 50
     cost_fruit = 20
     cost_fruit_distance = 2  # Cost of being far from fruit
     cost_fruit_distance_nearest = 4  # Extra cost on nearest snake to fruit
     cost_final_distance = 1  # Distance cost when no fruit left
     cost_final_distance_furthest = 2  # Extra cost for furthest snake
-    cost_move_length = 1  # How many moves we amde to get here
     cost_elevation = 0.5
 
     score = 0
 
+    # Distances are looked up in the level's tables, so this only touches
+    # the heads and the fruit cells rather than the whole board
+    width = level.width
     heads = []
-    for y, row in enumerate(board):
-        for x, elem in enumerate(row):
-            is_head = re.match('^snake ... 0', elem)
-            if is_head:
-                score += cost_live_snake
-                score += y * cost_elevation
-                heads.append((y, x))
+    for segments in board.snakes.values():
+        head = segments[0]
+        score += cost_live_snake
+        score += head // width * cost_elevation
+        heads.append(head)
 
     if game.any_fruit_exists(board):
         nearest_cost = 10000
-        for y, row in enumerate(board):
-            for x, elem in enumerate(row):
-                is_fruit = elem == 'fruit'
-                if is_fruit:
-                    score += cost_fruit
-                    fruit = (y, x)
-                    for head in heads:
-                        dist = abs(head[0] - fruit[0]) + abs(head[1] - fruit[1])
-                        score += dist * cost_fruit_distance
-                        nearest_cost = min(nearest_cost, dist * cost_fruit_distance_nearest)
-    else:
+        cells = board.cells
+        for fruit, distance in level.fruit_distance.items():
+            if cells[fruit] != gamestate.FRUIT:
+                continue  # Already eaten
+            score += cost_fruit
+            for head in heads:
+                dist = distance[head]
+                score += dist * cost_fruit_distance
+                nearest_cost = min(nearest_cost,
+                                   dist * cost_fruit_distance_nearest)
+    elif level.end_distance is not None:
         furthest_cost = 0
+        distance = level.end_distance
         for head in heads:
-            dist = abs(head[0] - endpoint[0]) + abs(head[1] - endpoint[1])
+            dist = distance[head]
             score += dist * cost_final_distance
-            furthest_cost = max(furthest_cost, dist * cost_final_distance_furthest)
+            furthest_cost = max(furthest_cost,
+                                dist * cost_final_distance_furthest)
         score += furthest_cost
 
-    score += cost_move_length * len(cur_move) / 2
-
     return score
 
 
@@ -80,147 +87,272 @@ def pprint_move(move):
 
 
 def hash_board(board):
-    h = hashlib.md5()
-    for row in board:
-        for elem in row:
-            h.update(elem.encode('utf-8'))
-    return h.digest()
-
-
-def make_move(board, teleports, endpoint, move):
-    colors = {
-        'r': 'red',
-        'g': 'grn',
-        'b': 'blu'}
-    directions = {
-        'w': 'up',
-        'a': 'left',
-        's': 'down',
-        'd': 'right'}
-
-    color = colors[move[0]]
-    direction = directions[move[1]]
-
-    board, teleports, endpoint = game.move_board_state(
-            board, teleports, endpoint, color, direction)
-
-    return board, teleports, endpoint
-
-
-cache = {}
-evict = []
-c_size = 250
-
-def check_board_cache(move):
-    global cache
-    global evict
-    result = None
-    while move:
-        if result:
-            if move in evict:
-                evict.remove(move)
-                evict.insert(0, move)
-        elif move in cache.keys():
-            result = move, cache[move]
-        move = move[:-2]
-
-    return result
-
-
-def add_to_cache(move, board):
-    global cache
-    global evict
-    if move in evict:
-        evict.remove(move)
-        evict.insert(0, move)
-        return
-
-    cache[move] = board
-    evict.insert(0, move)
-
-    if len(evict) > c_size:
-        for evicted in evict[c_size:]:
-            del cache[evicted]
-        evict = evict[:c_size]
-
-
-def move_to_board(board, teleports, endpoint, moves):
-    cached = check_board_cache(moves)
-    if cached:
-        board = cached[1]
-        c_moves = cached[0]
-        moves = moves[len(c_moves):]
-
-    for move in zip(moves[0::2], moves[1::2]):
-        board, teleports, endpoint = make_move(board, teleports, endpoint, move)
-
-    return board, teleports, endpoint
-
-
-def solve(board, teleports, endpoint):
-    # Set of boards already dealt with (hashes of board states)
-    closed_set = {}
-    # Set of boards we need to deal with (priorty queue of move strings)
-    open_set = []
-    counter = itertools.count()
-    score = score_heuristic(board, teleports, endpoint, '')
-    heapq.heappush(open_set, (score, next(counter), ''))
-
-    i = 0
-    while True:
-        i += 1
-        # Add ourselves to the already seen states
-        if len(open_set) == 0:
-            raise Exception("No solution!")
-        cur_score, _, cur_move = heapq.heappop(open_set)
-        cur_board, _, _ = move_to_board(board, teleports, endpoint, cur_move)
-
-        h = hash_board(cur_board)
-        if h in closed_set.keys():
-            #print(f"Skipping iteration #{i}. Already evaluated on seperate route.")
-            if cur_move >= closed_set[h]:
-                continue  # Only skip if the other move is actualy equal or better
-        closed_set[h] = cur_move
-        
-        print(gameboard.draw_board(cur_board, teleports, endpoint))
-        nmoves = int(len(cur_move) / 2)
-        print(f"Iteration #{i}. Move #{nmoves}. Score:{cur_score}")
-        print(pprint_move(cur_move))
-
-        # First let's find all snakes and possiblem oves
-        colors = []
-        for y, row in enumerate(board):
-            for x, elem in enumerate(row):
-                is_head = re.match('^snake ... 0', elem)
-                if is_head:
-                    colors.append(elem[6])
-        next_moves = []
-        for color in colors:
-            for direction in ['w', 'a', 's', 'd']:
-                next_moves.append(color + direction)
-
-        for mv in next_moves:
-            move = cur_move + mv
-            try:
-                next_board, _, _ = make_move(
-                        cur_board, teleports, endpoint, mv)
-            except game.MissionComplete:
-                return move  # Done! Horray
-            except (game.InvalidMove, game.IllegalMove, game.UnsafeMove):
-                continue
-            else:
-                h = hash_board(next_board)
-                if h in closed_set.keys():  # Already seen this state (a loop)
-                    continue
-                add_to_cache(move, next_board)
-                score = score_heuristic(next_board, teleports, endpoint, move)
-                heapq.heappush(open_set, (score, next(counter), move))
+    # Zobrist hash, updated incrementally by the move engine
+    return board.hash
+
+
+def blind_heuristic(level, board):
+    """No estimate at all, turns A* into uniform cost search."""
+    return 0
+
+
+heuristics = {
+    'weighted': score_heuristic,
+    'blind': blind_heuristic,
+    'reach': reach_heuristic,
+    'pdb': pdb_heuristic,
+}
+
+# Heuristics that never overestimate, and strategies that return shortest
+# solutions with them at weight 1
+admissible = {'blind', 'reach', 'pdb'}
+optimal_strategies = {'astar', 'bfs', 'idastar'}
+
+
+def board_trace(level, stream=sys.stdout, color=True):
+    """A ``Reporter`` trace callback that draws every expanded node."""
+    renderer = Renderer(level, stream, color=color)
+
+    def trace(node, board, score, h):
+        stream.write(renderer.draw(board) + '\n')
+        stream.write(f"Move #{node.g}. Score:{score}. Estimate:{h}\n")
+        stream.write(pprint_move(node.moves()) + '\n')
+
+    return trace
+
+
+def solve(board, teleports, endpoint, strategy='astar', heuristic=None,
+          weight=None, check_hash=False, reporter=None, trace=None,
+          stats=None, optimal=False, cache=None, prune=True,
+          symmetry=False, macro=False, endgame=False, batch=1,
+          **options):
+    """Search for a solution to a level, returns the move string.
+
+    ``strategy`` and ``heuristic`` name entries in ``search.strategies``
+    and ``heuristics``, ``weight`` overrides the heuristic weight of
+    strategies that use one. Other options are passed on to the strategy.
+
+    With ``optimal`` set the solution is guaranteed to be a shortest one,
+    the heuristic defaults to ``'pdb'`` and combinations that can't promise
+    that raise ValueError. Otherwise it defaults to ``'weighted'``.
+
+    The search is quiet unless a ``report.Reporter`` is passed in. A
+    ``trace`` of ``'board'`` traces by drawing every expanded board to
+    stdout, any other trace is handed to the reporter as is. Pass a
+    ``report.Stats`` as ``stats`` to get the search counters back.
+
+    With ``prune`` set states the level can't be finished from are dropped
+    as soon as they're generated, see ``prune.Pruner``. With ``symmetry``
+    set states that only differ by snake colours, block numbers or a
+    mirror image share a closed set entry, see ``symmetry.Canonical``.
+    With ``macro`` set the best first strategies queue whole walks of one
+    snake as single successors, see ``macro.macro_moves``. With ``endgame``
+    set they also try walking every snake out once the fruit's all gone,
+    see ``endgame.endgame``. A ``batch`` over 1 has them pop that many
+    nodes at a time and expand them together, see ``search.batch_moves``.
+
+    ``cache`` is a ``cache.SolutionCache`` or the path of one. Levels found
+    there aren't searched at all, anything solved is added to it.
+    """
+    heuristic = _check_options(strategy, heuristic, weight, optimal, macro,
+                               endgame, batch)
+    if cache is not None:
+        return _cached_solve(cache, board, teleports, endpoint,
+                             strategy=strategy, heuristic=heuristic,
+                             weight=weight, check_hash=check_hash,
+                             reporter=reporter, trace=trace, stats=stats,
+                             optimal=optimal, prune=prune,
+                             symmetry=symmetry, macro=macro,
+                             endgame=endgame, batch=batch, **options)
+    level = gamelevel.compile_level(board, teleports, endpoint)
+    board = gamestate.from_grid(board, level)
+    return solve_level(level, board, strategy=strategy, heuristic=heuristic,
+                       weight=weight, check_hash=check_hash,
+                       reporter=reporter, trace=trace, stats=stats,
+                       optimal=optimal, prune=prune, symmetry=symmetry,
+                       macro=macro, endgame=endgame, batch=batch, **options)
+
+
+def _check_options(strategy, heuristic, weight, optimal, macro, endgame,
+                   batch):
+    """The heuristic to use, raises ValueError for options that clash."""
+    if heuristic is None:
+        heuristic = 'pdb' if optimal else 'weighted'
+    if (macro or endgame or batch > 1) and strategy == 'idastar':
+        raise ValueError("idastar doesn't support macro moves, endgames or "
+                         "batches")
+    if macro and batch > 1:
+        raise ValueError("macro moves can't be expanded in batches")
+    if optimal and (strategy not in optimal_strategies
+                    or heuristic not in admissible
+                    or weight not in (None, 1)):
+        raise ValueError(f"{strategy} with {heuristic} heuristic at weight "
+                         f"{weight} doesn't guarantee optimal solutions")
+    return heuristic
+
+
+def solve_level(level, board, strategy='astar', heuristic=None, weight=None,
+                check_hash=False, reporter=None, trace=None, stats=None,
+                optimal=False, prune=True, symmetry=False, macro=False,
+                endgame=False, batch=1, **options):
+    """Like ``solve``, for a Level and the State it starts in.
+
+    For levels that are already compiled, see ``compiled.loads``. There's
+    no ``cache`` as the cache is keyed by the level's text grid.
+    """
+    heuristic = _check_options(strategy, heuristic, weight, optimal, macro,
+                               endgame, batch)
+    # Recompute every hash from scratch as well, to catch drift
+    level.check_hash = check_hash
+    if reporter is None:
+        reporter = Reporter()
+    if trace == 'board':
+        trace = board_trace(level)
+    if trace is not None:
+        reporter.trace = trace
+    if weight is not None:
+        options['weight'] = weight
+    if stats is None:
+        stats = Stats()
+    if prune:
+        options['prune'] = Pruner(level, board)
+    if macro:
+        options['expand'] = macro_moves
+    if endgame:
+        options['endgame'] = endgame_search
+    if batch > 1:
+        options['batch'] = batch
+    key = hash_board(board)
+    if symmetry:
+        options['canonical'] = Canonical(level)
+        key = options['canonical'](board)
+    root = search.Node(board, None, '', key)
+    goal = None
+    try:
+        goal = search.strategies[strategy](
+            level, root, heuristics[heuristic], reporter=reporter,
+            stats=stats, **options)
+    finally:
+        reporter.finish(goal)
+    return goal.moves()
+
+
+def _cached_solve(cache, board, teleports, endpoint, optimal, **options):
+    from cache import SolutionCache, level_key
+    if not isinstance(cache, SolutionCache):
+        with SolutionCache(cache) as cache:
+            return _cached_solve(cache, board, teleports, endpoint, optimal,
+                                 **options)
+    key = level_key(board, teleports, endpoint)
+    hit = cache.get(key, optimal)
+    if hit is not None:
+        if hit[0] is None:
+            raise search.NoSolution()
+        return hit[0]
+    try:
+        solution = solve(board, teleports, endpoint, optimal=optimal,
+                         **options)
+    except search.NoSolution:
+        cache.put(key, None)
+        raise
+    cache.put(key, solution, optimal)
+    return solution
 
 
 if __name__ == '__main__':
-    import sys
-    board = gameboard.load_file(sys.argv[1])
+    import argparse
+    parser = argparse.ArgumentParser(description="Solve a snakebird level")
+    parser.add_argument('level', help="level file to solve, or a level "
+                                      "in a pack as pack.sbp#17")
+    parser.add_argument('--strategy', default='astar',
+                        choices=sorted(search.strategies))
+    parser.add_argument('--heuristic', choices=sorted(heuristics),
+                        help="default: weighted, or pdb with --optimal")
+    parser.add_argument('--weight', type=float,
+                        help="heuristic weight for wastar and idastar")
+    parser.add_argument('--optimal', action='store_true',
+                        help="only search in ways that find a shortest "
+                             "solution")
+    parser.add_argument('--workers', type=int,
+                        help="search with hash distributed A* over this "
+                             "many processes, only astar options apply")
+    parser.add_argument('--progress', type=float, metavar='SECONDS',
+                        help="print a progress summary this often")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write every expanded node to FILE, "
+                             "'board' to draw them to stdout")
+    parser.add_argument('--no-prune', dest='prune', action='store_false',
+                        help="don't drop states that can't be finished")
+    parser.add_argument('--symmetry', action='store_true',
+                        help="treat states that only differ by colours, "
+                             "block numbers or a mirror image as one")
+    parser.add_argument('--macro', action='store_true',
+                        help="queue whole walks of a snake as one move")
+    parser.add_argument('--endgame', action='store_true',
+                        help="walk the snakes out one by one once the "
+                             "fruit's all gone")
+    parser.add_argument('--batch', type=int, default=1, metavar='K',
+                        help="expand this many nodes at a time")
+    parser.add_argument('--cache', metavar='FILE',
+                        help="reuse and store solutions in this database")
+    parser.add_argument('--play', type=float, nargs='?', const=0.2,
+                        metavar='SECONDS',
+                        help="animate the solution, a move this often")
+    parser.add_argument('--stats', action='store_true',
+                        help="print search counters and timings at the end")
+    parser.add_argument('--profile', action='store_true',
+                        help="run the search under cProfile")
+    parser.add_argument('--memory', action='store_true',
+                        help="trace allocations with tracemalloc")
+    args = parser.parse_args()
+    if args.workers:
+        unsupported = [flag for flag, used in (
+            ('--strategy', args.strategy != 'astar'),
+            ('--trace', args.trace), ('--cache', args.cache),
+            ('--symmetry', args.symmetry), ('--macro', args.macro),
+            ('--endgame', args.endgame), ('--batch', args.batch > 1))
+            if used]
+        if unsupported:
+            parser.error(f"--workers can't be used with "
+                         f"{', '.join(unsupported)}")
+    board = gameboard.load_file(args.level)
     print(gameboard.draw_board(*board))
-    sol = solve(*board)
+    trace = args.trace
+    if trace is not None and trace != 'board':
+        trace = open(trace, 'w')
+    stats = Stats()
+    try:
+        with profiled(cpu=args.profile, memory=args.memory):
+            if args.workers:
+                import parallel
+                heuristic = _check_options('astar', args.heuristic,
+                                           args.weight, args.optimal,
+                                           False, False, 1)
+                stats = {}
+                sol = parallel.solve(*board, workers=args.workers,
+                                     heuristic=heuristics[heuristic],
+                                     weight=args.weight or 1,
+                                     optimal=args.optimal, stats=stats,
+                                     prune=args.prune)
+            else:
+                sol = solve(*board, strategy=args.strategy,
+                            heuristic=args.heuristic, weight=args.weight,
+                            reporter=Reporter(args.progress), trace=trace,
+                            stats=stats, optimal=args.optimal,
+                            cache=args.cache, prune=args.prune,
+                            symmetry=args.symmetry, macro=args.macro,
+                            endgame=args.endgame, batch=args.batch)
+    finally:
+        if trace is not None and trace != 'board':
+            trace.close()
+    if args.stats and args.workers:
+        print(f"Expanded per worker: {stats['expanded']}", file=sys.stderr)
+    elif args.stats:
+        print(stats, file=sys.stderr)
     print("Solution Found!")
     print(pprint_move(sol))
+    if args.play:
+        import render
+        level = gamelevel.compile_level(*board)
+        render.play(level, gamestate.from_grid(board[0], level), sol,
+                    delay=args.play, diff=sys.stdout.isatty())
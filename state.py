@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import functools
+import random
+from array import array
+
+from board import boardtable
+
+
+# Cell codes, one per kind of element in the board table. Snake heads are
+# not a separate kind, the head is always the first entry of the snake's
+# segment array.
+kinds = [brd[0] for brd in boardtable if not brd[0].endswith(' 0')]
+codes = {kind: code for code, kind in enumerate(kinds)}
+
+SPACE = codes['space']
+SOLID = codes['solid']
+SPIKE = codes['spike']
+FRUIT = codes['fruit']
+
+# Snake colour <-> cell code
+snake_codes = {k[6:]: c for k, c in codes.items() if k.startswith('snake')}
+snake_colors = {c: color for color, c in snake_codes.items()}
+# Block cell codes
+block_codes = {c for k, c in codes.items() if k.startswith('block')}
+
+
+class Zobrist:
+    """Random 64 bit keys for hashing a State incrementally.
+
+    There's one key per cell for every fruit, snake and block cell kind and
+    one per cell for every snake segment number, as the cell kinds alone
+    don't say which way a snake's body is linked.
+    """
+    __slots__ = ('kinds', 'order')
+
+    def __init__(self, area, length, seed=0):
+        rnd = random.Random(seed)
+
+        def keys():
+            return array('Q', [rnd.getrandbits(64) for _ in range(area)])
+
+        zeros = array('Q', bytes(8 * area))
+        # Space and terrain never contribute to the hash
+        self.kinds = [zeros if code in (SPACE, SOLID, SPIKE) else keys()
+                      for code in range(len(kinds))]
+        self.order = [keys() for _ in range(length)]
+
+    def segments_hash(self, segments):
+        h = 0
+        order = self.order
+        for k, idx in enumerate(segments):
+            h ^= order[k][idx]
+        return h
+
+    def full_hash(self, state):
+        """Hash of a State computed from scratch."""
+        h = 0
+        kinds = self.kinds
+        for idx, code in enumerate(state.cells):
+            if code != SPACE:
+                h ^= kinds[code][idx]
+        for segments in state.snakes.values():
+            h ^= self.segments_hash(segments)
+        return h
+
+
+@functools.lru_cache(maxsize=16)
+def zobrist_table(area, length):
+    """Keys are seeded, so the same board size always gets the same table."""
+    return Zobrist(area, length)
+
+
+class State:
+    """Packed dynamic board state, the Level holds everything static.
+
+    ``cells`` is a flat row-major bytearray of cell codes for fruit, snakes
+    and blocks, terrain cells are left as space. ``snakes`` maps a snake
+    colour to an array of cell indexes, head first, and ``blocks`` maps a
+    block's cell code to the indexes it covers. The segment arrays are
+    never mutated in place, so copies may share them. ``hash`` is the
+    Zobrist hash, kept up to date by the move engine.
+    """
+    __slots__ = ('cells', 'snakes', 'blocks', 'fruit', 'hash')
+
+    def __init__(self, cells, snakes, blocks, fruit, hash=0):
+        self.cells = cells
+        self.snakes = snakes
+        self.blocks = blocks
+        self.fruit = fruit
+        self.hash = hash
+
+    def copy(self):
+        return State(bytearray(self.cells), dict(self.snakes),
+                     dict(self.blocks), self.fruit, self.hash)
+
+    def body(self, code):
+        """Cell indexes of the snake or block with the given cell code."""
+        if code in snake_colors:
+            return self.snakes[snake_colors[code]]
+        return self.blocks[code]
+
+    def bodies(self):
+        """Yield ``(code, cells)`` for every snake and block."""
+        for color, segments in self.snakes.items():
+            yield snake_codes[color], segments
+        yield from self.blocks.items()
+
+
+def from_grid(board, level):
+    """Pack a text grid from ``board.load_board`` into a State."""
+    width = level.width
+    cells = bytearray(width * level.height)
+    heads = {}
+    blocks = {}
+    fruit = 0
+    for y, row in enumerate(board):
+        for x, elem in enumerate(row):
+            spl = elem.split()
+            code = codes[' '.join(spl[0:2])]
+            if code in (SOLID, SPIKE):
+                continue
+            idx = y * width + x
+            cells[idx] = code
+            if code == FRUIT:
+                fruit += 1
+            elif code in block_codes:
+                blocks.setdefault(code, array('i')).append(idx)
+            elif len(spl) >= 3 and spl[2] == '0':
+                heads[spl[1]] = (y, x)
+
+    snakes = {}
+    for color, (y, x) in heads.items():
+        segments = array('i')
+        while True:
+            segments.append(y * width + x)
+            spl = board[y][x].split()
+            if len(spl) < 5:
+                break
+            y, x = int(spl[3]), int(spl[4])
+        snakes[color] = segments
+
+    state = State(cells, snakes, blocks, fruit)
+    state.hash = level.zobrist.full_hash(state)
+    return state
+
+
+def to_grid(state, level):
+    """Unpack a State back into the linked text grid ``draw_board`` uses."""
+    width = level.width
+    grid = []
+    for y in range(level.height):
+        row = slice(y * width, (y + 1) * width)
+        grid.append([kinds[code or terrain] for code, terrain
+                     in zip(state.cells[row], level.terrain[row])])
+    for color, segments in state.snakes.items():
+        last = len(segments) - 1
+        for segment, idx in enumerate(segments):
+            y, x = divmod(idx, width)
+            elem = f'snake {color} {segment}'
+            if segment < last:
+                n_y, n_x = divmod(segments[segment+1], width)
+                elem += f' {n_y} {n_x}'
+            grid[y][x] = elem
+    return grid
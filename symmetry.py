@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Telling apart states that only differ in ways the rules don't care about.
+
+All snakes follow the same rules whatever their colour, and so do blocks
+whatever their number, so swapping colours or block numbers around gives
+a state that's solved by the same moves with the letters swapped. On a
+level that's the same mirrored left to right, so is the mirror image of a
+state with left and right swapped. Giving all of those one key in the
+closed set means only one of them gets searched.
+"""
+from array import array
+
+from state import FRUIT
+
+
+def mirror_map(level):
+    """Cell index of each cell's mirror image, None for uneven levels.
+
+    The terrain, fruit, endpoint and teleports all have to look the same
+    mirrored for the level to count, with teleports mirroring onto the
+    mirror image of the teleport they're paired with. Cached on the level.
+    """
+    if 'mirror' in level.cache:
+        return level.cache['mirror']
+    width = level.width
+    mirror = array('i', [(idx - idx % width) + width - 1 - idx % width
+                         for idx in range(width * level.height)])
+    terrain = level.terrain
+    portal = level.portal
+
+    def paired(idx):
+        # Where the mirrored teleport goes is the mirror of where it goes
+        exit = portal[idx]
+        return portal[mirror[idx]] == (mirror[exit] if exit >= 0 else -1)
+
+    if any(terrain[idx] != terrain[twin] for idx, twin in enumerate(mirror)) \
+            or {mirror[idx] for idx in level.fruit} != set(level.fruit) \
+            or {mirror[idx] for idx in level.teleports} != \
+            set(level.teleports) \
+            or not all(paired(idx) for idx in level.teleports) \
+            or (level.endpoint >= 0 and
+                mirror[level.endpoint] != level.endpoint):
+        mirror = None
+    level.cache['mirror'] = mirror
+    return mirror
+
+
+class Canonical:
+    """Calling it with a state gives a key shared by all equivalent states.
+
+    Snakes are keyed by their cells alone and blocks by the cells they
+    cover, both sorted so colours and block numbers drop out. With
+    ``mirror`` set, and a level that's mirror symmetric, the key is the
+    smaller of the state's and its mirror image's.
+    """
+
+    def __init__(self, level, mirror=True):
+        self.level = level
+        self.mirror = mirror_map(level) if mirror else None
+
+    def __call__(self, board):
+        fruit = tuple(idx for idx in self.level.fruit
+                      if board.cells[idx] == FRUIT)
+        key = hash((tuple(sorted(tuple(s) for s in board.snakes.values())),
+                    tuple(sorted(tuple(b) for b in board.blocks.values())),
+                    fruit))
+        mirror = self.mirror
+        if mirror is None:
+            return key
+        snakes = tuple(sorted(tuple(mirror[idx] for idx in s)
+                              for s in board.snakes.values()))
+        blocks = tuple(sorted(tuple(sorted(mirror[idx] for idx in b))
+                              for b in board.blocks.values()))
+        fruit = tuple(sorted(mirror[idx] for idx in fruit))
+        return min(key, hash((snakes, blocks, fruit)))
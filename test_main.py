@@ -1,8 +1,28 @@
+import io
+import os
 import pytest
 from textwrap import dedent
+import bench
+import compiled
+import game
+import pack
+import parallel
+import search
 from game import IllegalMove, UnsafeMove, MissionComplete
-from game import move_board_state
-from board import load_board, draw_board
+from game import move_board_state, apply_move, undo
+from board import load_board, load_file, draw_board, iter_pack
+from state import from_grid, to_grid
+from level import Level, compile_level
+from cache import SolutionCache, level_key
+from solver import solve, solve_level, score_heuristic, blind_heuristic
+from solver import heuristics
+from batch import find_levels, solve_levels
+from report import Stats
+from search import NoSolution, batch_order
+from prune import Pruner
+from symmetry import Canonical, mirror_map
+from endgame import endgame
+from render import Renderer, play
 
 
 def brd(board):
@@ -29,6 +49,12 @@ def execute(board, moves):
                       color=False, fancy=False).strip()
 
 
+def packed(board):
+    grid, teleports, endpoint = load_board(board, padding=0)
+    level = compile_level(grid, teleports, endpoint)
+    return grid, level, from_grid(grid, level)
+
+
 def test_move_simple():
     result = None
     board = brd("""
@@ -137,6 +163,82 @@ def test_finish_fall():
     assert result is None
 
 
+def test_fall_off_board():
+    # Only part of the snake is over the hole, but it still falls through
+    grid, level, state = packed(brd("""
+        Rr__
+        _r__
+        _r__
+        _r__
+        #___
+    """))
+    with pytest.raises(UnsafeMove):
+        game.update_gravity(level, state, game.Undo(level, state))
+    assert to_grid(state, level) == grid
+
+    # Blocks that fall out of the bottom are gone
+    result = execute(brd("""
+        1___
+        11__
+        _1rR
+        _1##
+        #_##
+    """), "rw")
+    assert result == brd("""
+        ____
+        ___R
+        ___r
+        __##
+        #_##
+    """)
+
+
+def test_teleport():
+    board = brd("""
+        ___X____
+        __rR____
+        ___#____
+        __X#____
+        ________
+        ########
+    """)
+    # Comes out the other side and falls from there
+    assert execute(board, "rw") == brd("""
+        ___X____
+        ________
+        ___#____
+        __R#____
+        __r_____
+        ########
+    """)
+    board = brd("""
+        ________
+        rrRX__X_
+        ####__##
+        ########
+    """)
+    # Only goes through once, it has to walk off and back on to return
+    assert execute(board, "rdrd") == brd("""
+        ________
+        ___X_rrR
+        ####__##
+        ########
+    """)
+    board = brd("""
+        ________
+        rrRX_1X_
+        ####_1##
+        ########
+    """)
+    # Nowhere to come out, so it stays put
+    assert execute(board, "rd") == brd("""
+        ________
+        _rrR_1X_
+        ####_1##
+        ########
+    """)
+
+
 def test_space_snake():
     result = None
     board = brd("""
@@ -201,3 +303,848 @@ def test_spikedrop_b():
     with pytest.raises(UnsafeMove):
         result = execute(board, "rw")
     assert result is None
+
+
+def test_packed_roundtrip():
+    board = brd("""
+        __F____
+        _rrR_1_
+        _r__11_
+        ##+####
+    """)
+    grid, level, state = packed(board)
+    assert list(state.snakes['red']) == [10, 9, 8, 15]
+    assert state.fruit == 1
+    assert state.cells[23] == 0  # Terrain lives in the level
+    assert to_grid(state, level) == grid
+
+
+def test_iter_pack(tmp_path):
+    pack = tmp_path / 'pack.txt'
+    pack.write_text(dedent("""
+        ; first
+        _rrR_O
+        ######
+
+        __X_gG
+        X_####
+
+        ; last
+        ; really the last
+        1_bB_O
+        ######
+    """))
+    levels = list(iter_pack(pack))
+    assert [name for name, _ in levels] == ['first', '2', 'really the last']
+    assert levels[0][1] == load_board('_rrR_O\n######')
+    assert levels[1][1][1] == [(1, 3), (2, 1)]
+    assert levels[2][1][0][1][1] == 'block 1'
+    assert load_board('') == ([['space'] * 2] * 3, [], None)
+
+
+def test_compiled_level(tmp_path):
+    grid = load_file('levels/2')
+    level = compile_level(*grid)
+    state = from_grid(grid[0], level)
+    data = compiled.compile_board(*grid)
+    loaded, start = compiled.loads(data)
+    for name in ('width', 'height', 'terrain', 'endpoint', 'teleports',
+                 'drop', 'ground', 'step', 'portal', 'fruit'):
+        assert getattr(loaded, name) == getattr(level, name)
+    assert loaded.zobrist is level.zobrist
+    for name in Level.__slots__:
+        assert hasattr(loaded, name), name
+    assert to_grid(start, loaded) == grid[0]
+    assert start.hash == state.hash and start.fruit == state.fruit
+    assert solve_level(loaded, start) == solve(*grid)
+
+    # Records stream back one at a time
+    path = tmp_path / 'levels.sbl'
+    with open(path, 'wb') as f:
+        compiled.dump(level, state, f)
+        f.write(compiled.compile_board(*load_file('levels/1')))
+    with open(path, 'rb') as f:
+        levels = list(compiled.iter_load(f))
+    assert len(levels) == 2
+    assert to_grid(levels[1][1], levels[1][0]) == load_file('levels/1')[0]
+    with pytest.raises(ValueError):
+        compiled.loads(b'\0' * 64)
+
+
+def test_push_block():
+    result = None
+    board = brd("""
+        _rrR1__
+        #######
+    """)
+    result = execute(board, "rd")
+    desired = brd("""
+        __rrR1_
+        #######
+    """)
+    assert result == desired
+
+
+def test_undo_move():
+    board = brd("""
+        _rrR1___
+        ###_____
+        ###___##
+    """)
+    grid, level, state = packed(board)
+    log = apply_move(level, state, 'red', 'right')
+    moved = to_grid(state, level)
+    assert moved != grid
+    undo(state, log)
+    assert to_grid(state, level) == grid
+
+    # A failed move leaves the state as it was
+    apply_move(level, state, 'red', 'right')
+    with pytest.raises(UnsafeMove):
+        apply_move(level, state, 'red', 'right')
+    assert to_grid(state, level) == moved
+
+
+def test_try_move():
+    board = brd("""
+        _rrR1___
+        ###_____
+        ###___##
+    """)
+    grid, level, state = packed(board)
+    cells, hash = bytes(state.cells), state.hash
+    # Ruled out up front, nothing written
+    assert game.check_move(level, state, 'red', 'left') == game.ILLEGAL
+    assert game.try_move(level, state, 'red', 'left') == (game.ILLEGAL, None)
+    assert game.try_move(level, state, 'red', 'up') == (game.INVALID, None)
+    assert game.try_move(level, state, 'grn', 'up') == (game.INVALID, None)
+    assert bytes(state.cells) == cells and state.hash == hash
+
+    result, log = game.try_move(level, state, 'red', 'right')
+    assert result == game.MOVED
+    moved = to_grid(state, level)
+    assert game.try_move(level, state, 'red', 'right') == (game.UNSAFE, None)
+    assert to_grid(state, level) == moved
+    undo(state, log)
+    assert to_grid(state, level) == grid
+
+
+def test_expand_batch():
+    board = brd("""
+        ____F___
+        _rrR1_Gg
+        ###11_##
+        ########
+    """)
+    grid, level, state = packed(board)
+    moved = state.copy()
+    apply_move(level, moved, 'grn', 'left')
+    states = [state, moved]
+    results, hashes, boards = game.expand_batch(level, states, batch_order)
+    assert len(results) == len(hashes) == len(boards) == 2 * len(batch_order)
+    for i, start in enumerate(states):
+        for j, (snake, direction) in enumerate(batch_order):
+            k = i * len(batch_order) + j
+            copy = start.copy()
+            result, log = game.try_move(level, copy, snake, direction)
+            assert results[k] == result
+            if result == game.MOVED:
+                assert hashes[k] == copy.hash
+                assert to_grid(boards[k], level) == to_grid(copy, level)
+            else:
+                assert hashes[k] == 0 and boards[k] is None
+    assert to_grid(state, level) == grid
+
+    # Skipped states are still MOVED, just not copied
+    results, hashes, boards = game.expand_batch(
+        level, states, batch_order, skip=lambda i, h: True)
+    assert game.MOVED in results and boards == [None] * len(boards)
+
+    grid = load_file('levels/1')
+    optimal = solve(*grid, strategy='bfs')
+    assert len(solve(*grid, optimal=True, batch=4)) == len(optimal)
+    # Over the state budget the batch doesn't copy, moves are played again
+    assert len(solve(*grid, optimal=True, batch=4, max_states=1,
+                     checkpoint=2)) == len(optimal)
+    with pytest.raises(ValueError):
+        solve(*grid, macro=True, batch=4)
+
+
+def test_zobrist_incremental():
+    board = brd("""
+        ____F___
+        _rrR1_Gg
+        ###11_##
+        ########
+    """)
+    grid, level, state = packed(board)
+    start = state.hash
+    level.check_hash = True
+    apply_move(level, state, 'red', 'right')
+    assert state.hash != start
+    apply_move(level, state, 'red', 'up')
+    apply_move(level, state, 'grn', 'left')
+    assert state.hash == from_grid(to_grid(state, level), level).hash
+
+
+def test_solve_state_budget():
+    board = brd("""
+        ________
+        _F______
+        ##_____O
+        ###rrR__
+        ########
+    """)
+    grid = load_board(board, padding=0)
+    # With a budget of one stored state everything is rebuilt from the
+    # checkpoints by replaying moves
+    solution = solve(*grid, max_states=1, checkpoint=2)
+    assert solution == solve(*load_board(board, padding=0))
+    with pytest.raises(MissionComplete):
+        execute(board, solution)
+
+
+def test_level_tables():
+    board = brd("""
+        ____
+        _#__
+        ___+
+        ____
+    """)
+    _, level, _ = packed(board)
+    assert level.drop[1] == 0 and level.ground[1] == 1  # Solid right below
+    assert level.drop[3] == 1 and level.ground[3] == 2  # Spike two down
+    assert level.ground[0] == 0  # Open column
+    assert level.step['left'][4] == -1 and level.step['down'][4] == 8
+
+
+def test_distance_maps():
+    board = brd("""
+        F_#_
+        __#_
+        ____
+        ###O
+    """)
+    _, level, _ = packed(board)
+    fruit = level.fruit_distance[level.index(0, 0)]
+    # Around the wall rather than straight through it
+    assert fruit[level.index(0, 3)] == 7
+    assert fruit[level.index(3, 0)] == 16  # Terrain, never reached
+    assert level.end_distance[level.index(0, 0)] == 6
+
+
+def test_score_without_endpoint():
+    _, level, state = packed(brd("""
+        _rrR
+        ####
+    """))
+    assert level.end_distance is None
+    assert score_heuristic(level, state) == 50
+
+
+def test_climb_map():
+    board = brd("""
+        ____
+        _#__
+        ____
+        ###O
+    """)
+    _, level, _ = packed(board)
+    climb = level.climb_map(level.endpoint)
+    assert climb[level.index(0, 3)] == 0  # Falls straight in
+    assert climb[level.index(0, 0)] == 3
+    assert climb[level.index(2, 0)] == 3
+
+
+@pytest.mark.parametrize('heuristic', ['reach', 'pdb'])
+def test_admissible_heuristics(heuristic):
+    grid = load_file('levels/1')
+    level = compile_level(*grid)
+    state = from_grid(grid[0], level)
+    solution = solve(*grid, strategy='bfs')
+    optimal = solve(*grid, heuristic=heuristic, optimal=True)
+    assert len(optimal) == len(solution)
+    # Never more than the moves actually left along a shortest solution
+    moves = [solution[i:i + 2] for i in range(0, len(solution), 2)]
+    for played, move in enumerate(moves):
+        assert heuristics[heuristic](level, state) <= len(moves) - played
+        if played < len(moves) - 1:
+            search.apply_move(level, state, move)
+
+
+def test_optimal_rejects_inadmissible():
+    board = load_file('levels/1')
+    with pytest.raises(ValueError):
+        solve(*board, optimal=True, strategy='greedy')
+    with pytest.raises(ValueError):
+        solve(*board, optimal=True, heuristic='weighted')
+    # Weight 1 is plain A*, so it's still optimal
+    optimal = solve(*board, strategy='bfs')
+    for strategy in ('astar', 'bfs'):
+        assert len(solve(*board, optimal=True, strategy=strategy,
+                         weight=1)) == len(optimal)
+
+
+def test_prune_rules():
+    _, level, state = packed(brd("""
+        _#F#__
+        _###__
+        ______
+        rrR__O
+        ######
+    """))
+    assert Pruner(level, state)(state) == 'fruit_pocket'
+
+    _, level, state = packed(brd("""
+        __F___
+        ______
+        ______
+        ______
+        rR___O
+        ######
+    """))
+    assert Pruner(level, state)(state) == 'snake_wedged'
+
+    grid, level, state = packed(brd("""
+        __F___
+        ______
+        ______
+        ______
+        rR_11O
+        ######
+    """))
+    prune = Pruner(level, state)
+    assert prune(state) is None
+    # Same thing with the block gone
+    grid[4][3] = grid[4][4] = 'space'
+    assert prune(from_grid(grid, level)) == 'block_lost'
+
+    # Hooked over the pillar the block bridges all of its cells of the
+    # walk down, not just its width and height
+    _, level, state = packed(brd("""
+        ____F___O
+        _________
+        _________
+        _________
+        _________
+        _________
+        111______
+        1#1______
+        1#1______
+        _#____rR_
+        #########
+    """))
+    assert Pruner(level, state)(state) is None
+
+    _, level, state = packed(brd("""
+        rR_#__
+        ###O__
+        ######
+    """))
+    assert Pruner(level, state)(state) == 'exit_pocket'
+
+
+def test_canonical_keys():
+    _, level, state = packed(brd("""
+        ___O___
+        _______
+        rR_1_Gg
+        #######
+    """))
+    canonical = Canonical(level)
+    assert mirror_map(level) is not None
+    # Colours and block numbers swapped
+    swapped = from_grid(load_board(brd("""
+        ___O___
+        _______
+        gG_2_Rr
+        #######
+    """), padding=0)[0], level)
+    assert canonical(swapped) == canonical(state)
+    assert swapped.hash != state.hash
+    # And the mirror image
+    moved = from_grid(load_board(brd("""
+        ___O___
+        _______
+        _rR1_Gg
+        #######
+    """), padding=0)[0], level)
+    mirrored = from_grid(load_board(brd("""
+        ___O___
+        _______
+        gG_1Rr_
+        #######
+    """), padding=0)[0], level)
+    assert canonical(moved) == canonical(mirrored)
+    assert canonical(moved) != canonical(state)
+    assert Canonical(level, mirror=False)(moved) != \
+        Canonical(level, mirror=False)(mirrored)
+
+    _, level, _ = packed(brd("""
+        ___O__
+        ______
+        rR_1__
+        ######
+    """))
+    assert mirror_map(level) is None
+
+    # The teleports look the same mirrored, but they're paired differently
+    _, level, _ = packed(brd("""
+        __X__
+        X___X
+        __X__
+        #####
+    """))
+    assert mirror_map(level) is None
+    _, level, _ = packed(brd("""
+        X___X
+        _X_X_
+        #####
+    """))
+    assert mirror_map(level) is not None
+
+
+def test_stacked_fall():
+    result = None
+    board = brd("""
+        ___1___
+        __rrR__
+        __#__2_
+        __#__2_
+        __#____
+        #######
+    """)
+    # Red rests on block 2, block 1 rests on red, they all drop together
+    result = execute(board, "rd")
+    desired = brd("""
+        _______
+        ___1___
+        __#rrR_
+        __#__2_
+        __#__2_
+        #######
+    """)
+    assert result == desired
+
+
+def test_fall_after_finish():
+    result = None
+    board = brd("""
+        ___Bb__
+        __rR___
+        __#____
+        __#_O__
+        __#####
+    """)
+    # Red drops into the endpoint, blue falls into the gap it left
+    result = execute(board, "rd")
+    desired = brd("""
+        _______
+        _______
+        __#____
+        __#Bb__
+        __#####
+    """)
+    assert result == desired
+
+
+@pytest.mark.parametrize('board', [
+    """
+        ___1___
+        __rrR__
+        __#__2_
+        __#__2_
+        __#____
+        #######
+    """, """
+        ___Bb__
+        __rR___
+        __#____
+        __#_O__
+        __#####
+    """, """
+        _F_gG__
+        __rrR_3
+        _+#__23
+        __#__2_
+        ____+__
+        ___####
+    """])
+def test_vector_gravity(board, monkeypatch):
+    vector = pytest.importorskip('vector')
+    grid, level, state = packed(brd(board))
+    assert vector.bounds(level, state) == game._bounds(level, state)
+
+    # The same drop worked out both ways on a board big enough for NumPy
+    rows = brd(board).split('\n')
+    width = len(rows[0])
+    big = brd(board) + '\n' + '\n'.join(['_' * width] * 60) + \
+        '\n' + '#' * width
+    big = '\n'.join(row + '_' * 40 for row in big.split('\n'))
+    grid, level, state = packed(big)
+    monkeypatch.setattr(game, 'vector_area', 0)
+    monkeypatch.setattr(game, 'vector_work', 0)
+    falling = game._falls(level, state)
+    monkeypatch.setattr(game, 'vector', None)
+    assert falling == game._falls(level, state)
+
+
+@pytest.mark.parametrize('strategy', ['astar', 'wastar', 'greedy', 'bfs',
+                                      'idastar'])
+def test_solve_strategies(strategy):
+    board = brd("""
+        ________
+        _F______
+        ##_____O
+        ###rrR__
+        ########
+    """)
+    solution = solve(*load_board(board, padding=0), strategy=strategy)
+    with pytest.raises(MissionComplete):
+        execute(board, solution)
+    if strategy == 'bfs':
+        optimal = solve(*load_board(board, padding=0), strategy='idastar',
+                        heuristic='blind')
+        assert len(solution) == len(optimal)
+    if strategy in ('astar', 'greedy', 'bfs'):
+        with pytest.raises(ValueError):
+            solve(*load_board(board, padding=0), strategy=strategy, weight=2)
+
+
+@pytest.mark.parametrize('board', ["""
+        ________
+        _F______
+        ##_____O
+        ###rrR__
+        ########
+    """, """
+        _____F__
+        ________
+        ___##__O
+        rR___gG_
+        ########
+    """])
+def test_macro_moves(board):
+    board = brd(board)
+    grid = load_board(board, padding=0)
+    optimal = solve(*grid, strategy='bfs')
+    stats = Stats()
+    solution = solve(*grid, optimal=True, macro=True, stats=stats)
+    assert len(solution) == len(optimal)
+    with pytest.raises(MissionComplete):
+        execute(board, solution)
+    # Replaying several moves per node when states aren't kept
+    assert len(solve(*grid, optimal=True, macro=True, max_states=1,
+                     checkpoint=2)) == len(optimal)
+    with pytest.raises(ValueError):
+        solve(*grid, strategy='idastar', macro=True)
+
+
+def test_macro_walk_limit(monkeypatch):
+    grid = load_file('levels/1')
+    optimal = solve(*grid, strategy='bfs')
+    # A lone snake's walk is cut short, where it got to is still queued
+    monkeypatch.setattr('macro.walk_limit', 3)
+    solution = solve(*grid, optimal=True, macro=True)
+    assert len(solution) == len(optimal)
+
+
+def test_endgame(monkeypatch):
+    board = brd("""
+        ________O
+        _________
+        _rR__gG__
+        #########
+    """)
+    grid, level, state = packed(board)
+    cells = bytes(state.cells)
+    moves = endgame(level, state)
+    assert bytes(state.cells) == cells
+    # Green gets out of the way first, then red walks out after it
+    assert moves == 'gdgdgwgw' + 'rd' * 6 + 'rwrw'
+    with pytest.raises(MissionComplete):
+        execute(board, moves)
+
+    grid = load_board(board, padding=0)
+    stats = Stats()
+    solution = solve(*grid, optimal=True, endgame=True, stats=stats)
+    assert len(solution) == len(solve(*grid, strategy='bfs'))
+    assert stats.endgames
+    with pytest.raises(ValueError):
+        solve(*grid, strategy='idastar', endgame=True)
+
+    # Fruit left, or no way out without pushing, nothing to find
+    grid, level, state = packed(brd("""
+        ___F____O
+        _________
+        _rR__gG__
+        #########
+    """))
+    assert endgame(level, state) is None
+    grid, level, state = packed(brd("""
+        ______1_O
+        ______1__
+        _rR__#1__
+        #########
+    """))
+    assert endgame(level, state) is None
+
+    # The caches on the level don't grow past the limit
+    monkeypatch.setattr('endgame.cache_limit', 1)
+    grid, level, state = packed(board)
+    assert endgame(level, state) == moves
+    apply_move(level, state, 'grn', 'right')
+    assert endgame(level, state)
+    assert len(level.cache['endgame']) == 1
+
+
+def test_renderer():
+    board = brd("""
+        _X1____O
+        _rrR_gG_
+        _r###X#F
+        ########
+    """)
+    grid, level, state = packed(board)
+    teleports, endpoint = load_board(board, padding=0)[1:]
+    for color in (True, False):
+        for fancy in (True, False):
+            renderer = Renderer(level, color=color, fancy=fancy)
+            assert renderer.draw(state) == draw_board(
+                grid, teleports, endpoint, color=color, fancy=fancy)
+
+    # Diff mode draws everything once, then only the cells that changed
+    stream = io.StringIO()
+    renderer = Renderer(level, stream, color=False, fancy=False, diff=True)
+    renderer.update(state)
+    assert stream.getvalue() == '\033[2J\033[H' + board + '\n'
+    stream.seek(0)
+    stream.truncate()
+    apply_move(level, state, 'grn', 'right')
+    renderer.update(state)
+    assert stream.getvalue() == '\033[2;6H_gG\033[5;1H\033[J'
+
+    # Messages go below the board, and the frame after is drawn in full
+    stream.seek(0)
+    stream.truncate()
+    renderer.update(state, 'Cant do that')
+    assert stream.getvalue() == '\033[5;1H\033[JCant do that\n'
+    renderer.update(state)
+    assert stream.getvalue().endswith('\033[2J\033[H' + renderer.draw(state)
+                                      + '\n')
+
+    stream = io.StringIO()
+    before = state.copy()
+    play(level, state, 'rwgwgw', delay=0, stream=stream, color=False)
+    # Stops at the move that can't be made, leaving the state alone
+    assert stream.getvalue().count('\033[J') == 2
+    assert state.cells == before.cells and state.hash == before.hash
+
+    # A solution plays right through to the level being finished
+    grid = load_file('levels/1')
+    level = compile_level(*grid)
+    state = from_grid(grid[0], level)
+    solution = solve(*grid)
+    stream = io.StringIO()
+    play(level, state, solution, delay=0, stream=stream, color=False)
+    assert stream.getvalue().count('\033[J') == len(solution) // 2
+    assert state.snakes
+
+
+def test_solve_quiet_and_traced(capsys):
+    board = brd("""
+        ________
+        _F______
+        ##_____O
+        ###rrR__
+        ########
+    """)
+    traced = []
+    solution = solve(*load_board(board, padding=0),
+                     trace=lambda node, board, score, h: traced.append(node))
+    assert capsys.readouterr() == ('', '')
+    assert traced[0].g == 0
+    assert len(traced) >= len(solution) // 2
+
+
+@pytest.mark.parametrize('strategy', ['astar', 'idastar'])
+def test_solve_stats(strategy):
+    board = brd("""
+        ________
+        _F______
+        ##_____O
+        ###rrR__
+        ########
+    """)
+    stats = Stats()
+    solve(*load_board(board, padding=0), strategy=strategy,
+          heuristic='blind', stats=stats)
+    assert stats.expanded > 0
+    assert stats.generated >= stats.duplicates
+    assert stats.dead_ends['IllegalMove'] > 0
+    assert stats.peak_closed > 0
+    assert stats.move_time > 0
+    assert stats.as_dict()['cache_rate'] == 1.0
+
+
+def test_solution_cache(tmp_path):
+    board = load_board(brd("""
+        ________
+        _F______
+        ##_____O
+        ###rrR__
+        ########
+    """), padding=0)
+    path = str(tmp_path / 'cache.sqlite')
+    solution = solve(*board, cache=path)
+    with SolutionCache(path) as cache:
+        key = level_key(*board)
+        assert cache.get(key) == (solution, False)
+        assert cache.get(key, optimal=True) is None
+        # Hits don't search at all
+        cache.put(key, 'rw', optimal=True)
+        assert solve(*board, cache=cache, optimal=True) == 'rw'
+        # A longer one doesn't replace it
+        cache.put(key, 'rwrw')
+        assert cache.get(key) == ('rw', True)
+
+    # Other rule versions don't see it
+    with SolutionCache(path, rules=-1) as cache:
+        assert cache.get(key) is None
+        cache.put(key, None)
+        assert cache.get(key, optimal=True) == (None, True)
+        cache.prune()
+    with SolutionCache(path, rules=-1) as cache:
+        with pytest.raises(NoSolution):
+            solve(*board, cache=cache)
+
+
+def test_cache_rules_version(tmp_path):
+    board = load_board(brd("""
+        ____#____
+        rRX_#_X_O
+        #########
+    """), padding=0)
+    path = str(tmp_path / 'cache.sqlite')
+    key = level_key(*board)
+    # Recorded before teleports worked, when it couldn't be solved
+    with SolutionCache(path, rules=1) as cache:
+        cache.put(key, None)
+    with SolutionCache(path) as cache:
+        assert cache.get(key) is None
+        assert solve(*board, cache=cache) == 'rdrdrd'
+
+
+def test_batch_solve(tmp_path, monkeypatch):
+    (tmp_path / '10').write_text(brd("""
+        ________
+        _F______
+        ##_____O
+        ###rrR__
+        ########
+    """))
+    (tmp_path / '2').write_text(brd("""
+        _rrR_O_
+        #######
+    """))
+    (tmp_path / '3').write_text(brd("""
+        rrR_______O
+        ###_______#
+    """))
+    paths = find_levels(tmp_path)
+    assert [os.path.basename(p) for p in paths] == ['2', '3', '10']
+    results = {os.path.basename(r['level']): r
+               for r in solve_levels(paths, jobs=2, node_limit=1000)}
+    assert results['2']['solution'] == 'rdrd'
+    assert results['3']['status'] == 'unsolvable'
+    assert results['10']['status'] == 'solved'
+    assert results['10']['expanded'] > 0
+
+    # A worker dying takes the pool with it, every level still gets a result
+    monkeypatch.setattr('batch.solve_level', _crash)
+    results = {os.path.basename(r['level']): r
+               for r in solve_levels(paths, jobs=1)}
+    assert sorted(results) == ['10', '2', '3']
+    assert results['2']['status'] == 'error'
+    assert 'BrokenProcessPool' in results['2']['error']
+
+
+def _crash(*args, **options):
+    os._exit(1)
+
+
+def test_level_pack(tmp_path):
+    paths = find_levels('levels')
+    texts = []
+    for path in paths:
+        with open(path) as f:
+            texts.append(f.read())
+    path = str(tmp_path / 'levels.sbp')
+    pack.write_pack(path, texts)
+
+    with pack.LevelPack(path) as levels:
+        assert len(levels) == len(paths)
+        assert levels.load(2) == load_file('levels/2')
+        key = level_key(*load_file('levels/3'))
+        assert levels.key(3) == key and levels.find(key) == 3
+        for number in range(1, len(paths) + 1):
+            assert levels.find(levels.key(number)) == number
+        with pytest.raises(KeyError):
+            levels.find('0' * 64)
+        with pytest.raises(IndexError):
+            levels.text(len(paths) + 1)
+    assert load_file(f'{path}#4') == load_file('levels/4')
+    assert load_file(f'{path}#{key}') == load_file('levels/3')
+    assert pack.open_pack(path) is pack.open_pack(path)
+    assert find_levels(path) == [f'{path}#{n}'
+                                 for n in range(1, len(paths) + 1)]
+    with pytest.raises(ValueError):
+        pack.LevelPack('levels/1')
+    (tmp_path / 'short.sbp').write_bytes(b'SBP')
+    with pytest.raises(ValueError):
+        pack.LevelPack(str(tmp_path / 'short.sbp'))
+
+
+def test_parallel_solve():
+    board = brd("""
+        ________
+        _F______
+        ##_____O
+        ###rrR__
+        ########
+    """)
+    stats = {}
+    solution = parallel.solve(*load_board(board, padding=0), workers=3,
+                              heuristic=blind_heuristic, stats=stats)
+    optimal = solve(*load_board(board, padding=0), strategy='bfs')
+    assert len(solution) == len(optimal)
+    assert len(stats['expanded']) == 3
+    unpruned = parallel.solve(*load_board(board, padding=0), workers=2,
+                              heuristic=blind_heuristic, prune=False)
+    assert len(unpruned) == len(optimal)
+    with pytest.raises(MissionComplete):
+        execute(board, solution)
+
+    # Workers that fail or die stop the search rather than hang it
+    with pytest.raises(RuntimeError, match='ZeroDivisionError'):
+        parallel.solve(*load_board(board, padding=0), workers=2,
+                       heuristic=_broken_heuristic)
+    with pytest.raises(RuntimeError, match='exited'):
+        parallel.solve(*load_board(board, padding=0), workers=2,
+                       heuristic=_crash)
+
+
+def _broken_heuristic(level, board):
+    return 1 / 0
+
+
+def test_bench_compare():
+    text = bench.generate_level(16, 8, snakes=2, blocks=1, fruit=2, seed=3)
+    grid, level, state = packed(text)
+    assert len(state.snakes) == 2 and state.fruit == 2
+    baseline = {'results': {'a': {'move_us': 10.0, 'solve_s': 1.0,
+                                  'legal_moves': 4}}}
+    current = {'results': {'a': {'move_us': 13.0, 'solve_s': 1.1,
+                                 'legal_moves': 8}}}
+    assert bench.compare(baseline, current, 0.2) == \
+        [('a', 'move_us', 10.0, 13.0)]
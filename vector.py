@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Gravity bounds worked out with NumPy, for big boards.
+
+Needs NumPy, ``game`` only uses this when it's installed and the board is
+big enough for it to pay off (see ``game.vector_area``). The state's cells
+are already a grid of object ids (every snake and block has a cell code of
+its own) so they are read straight out of the bytearray without copying.
+
+Rather than walking down below every segment one cell at a time, the
+first thing below every cell of the columns the bodies are in is found in
+one go with a running minimum up each column, and the per segment bounds
+are reduced to per body ones with ``np.minimum.reduceat``.
+"""
+from itertools import accumulate
+
+import numpy as np
+
+from state import SPACE, SPIKE, FRUIT, snake_colors
+
+
+def _tables(level):
+    """The level's drop and ground tables as arrays, cached."""
+    tables = level.cache.get('vector')
+    if tables is None:
+        tables = level.cache['vector'] = (
+            np.frombuffer(level.drop, dtype=np.intc),
+            np.frombuffer(level.ground, dtype=np.uint8))
+    return tables
+
+
+def bounds(level, state):
+    """Same as ``game._bounds``, ``(bound, lost, resting)``."""
+    bodies = list(state.bodies())
+    never = len(state.cells)
+    if not bodies:
+        return {}, {}, {}
+    cells = np.frombuffer(state.cells, dtype=np.uint8)
+    drop, ground = _tables(level)
+    width = level.width
+
+    codes = [code for code, _ in bodies]
+    sizes = [len(segments) for _, segments in bodies]
+    segs = np.concatenate([np.frombuffer(segments, dtype=np.intc)
+                           for _, segments in bodies])
+    owner = np.repeat(np.array(codes, dtype=np.uint8), sizes)
+    snake = np.repeat(np.array([code in snake_colors for code in codes]),
+                      sizes)
+    starts = list(accumulate([0] + sizes[:-1]))
+
+    # Row of the first thing at or below each cell in the bodies' columns,
+    # with an extra row at the bottom for the segments on the last row
+    height = level.height
+    ys, xs = np.divmod(segs, width)
+    used = np.zeros(width, dtype=bool)
+    used[xs] = True
+    columns = np.flatnonzero(used)
+    column = np.cumsum(used)[xs] - 1
+    grid = cells.reshape(height, width)[:, columns]
+    rows = np.arange(height + 1)[:, None]
+    next_row = np.full((height + 1, len(columns)), height)
+    next_row[:-1] = np.where(grid != SPACE, rows[:-1], height)
+    next_row = np.minimum.accumulate(next_row[::-1], axis=0)[::-1]
+
+    # Only the free cells above the terrain count
+    free = drop[segs]
+    below = next_row[ys + 1, column]
+    found = below <= ys + free
+    first = below - ys - 1
+    target = cells[np.where(found, below * width + xs, segs)]
+    fall = np.full(len(segs), never, dtype=np.intp)
+    gone = np.full(len(segs), never, dtype=np.intp)
+
+    # Stopped by fruit, or by the terrain under the free cells
+    fruit = found & (target == FRUIT)
+    fall[fruit] = first[fruit]
+    # Or gone, off the bottom of the board or snakes onto spikes
+    under = ground[segs]
+    lost = ~found & ((under == SPACE) | snake & (under == SPIKE))
+    gone[lost] = free[lost] + 1
+    landed = ~found & ~lost
+    fall[landed] = free[landed]
+
+    resting = {}
+    other = found & (target != FRUIT) & (target != owner)
+    for i in np.flatnonzero(other):
+        resting.setdefault(int(target[i]), []).append(
+            (int(first[i]), int(owner[i])))
+
+    falls = np.minimum.reduceat(fall, starts)
+    losts = np.minimum.reduceat(gone, starts)
+    bound = dict(zip(codes, falls.tolist()))
+
+    # Snake heads can fall into the endpoint, if nothing stops them first
+    end = level.endpoint if not state.fruit else -1
+    if end >= 0:
+        for i, (code, segments) in zip(starts, bodies):
+            head = segments[0]
+            dist, col = divmod(end - head, width)
+            if code in snake_colors and dist > 0 and not col and \
+                    dist <= free[i] and (not found[i] or dist <= first[i]):
+                bound[code] = min(bound[code], dist)
+    return bound, dict(zip(codes, losts.tolist())), resting